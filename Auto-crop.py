@@ -4,7 +4,7 @@
 Crop borders from the script in the current tab
 
 
-Date: 2012-10-24
+Date: 2026-10-16
 Latest version: https://github.com/vdcrim/avsp-macros
 
 Changelog:
@@ -15,6 +15,18 @@ Changelog:
 - check the chroma subsampling also for the new AviSynth 2.6 colorspaces
   (AvsPmod 2.4.0+)
 - fix clips with less frames than samples
+- speed up the border detection by testing whole rows and columns of the 
+  frame at once instead of single pixels
+- add 'threads' option, to analyze the frames concurrently in several 
+  AviSynth environments
+- add 'confidence' option, to stop analyzing frames as soon as the crop 
+  values are settled
+- remember the results for the last analyzed scripts (see 'cache_size')
+- add 'coarse scan step' option, to locate the borders on a decimated 
+  frame first
+- add 'variable borders' option, to insert a Trim and Crop for every range 
+  of frames with different borders
+- add 'skip dark and flat frames' option
 
 
 Copyright (C) 2012  Diego Fernández Gosende <dfgosende@gmail.com>
@@ -45,6 +57,20 @@ tol = 70  # tolerance (0-255)
 overcrop = True # Up or down crop values because of chroma subsampling
 insert = True  #  insert Crop() at the end of the script
 refresh = True  # update and show if hidden the video preview
+threads = 1  # number of AviSynth environments analyzing frames concurrently. 1: use the preview clip
+confidence = 0  # stop when the crop values are settled with this confidence (%). 0: analyze all the samples
+scan_step = 1  # locate the borders testing first only every n-th line and refine them later. 1: test all
+var_step = 0  # analyze every n-th frame of the clip and crop every range with different borders. 0: disabled
+select = False  # skip dark and flat frames, choosing the samples among three times more candidates
+
+# Frames with a lower average luma or standard deviation (0-255) are 
+# skipped if 'select' is True
+dark_threshold = 32
+flat_threshold = 10
+
+# Number of results remembered for scripts already analyzed with the same 
+# settings. 0: don't remember any
+cache_size = 20
 
 
 # ------------------------------------------------------------------------------
@@ -52,10 +78,19 @@ refresh = True  # update and show if hidden the video preview
 
 # run in thread
 from collections import defaultdict
+import hashlib
+import os
+import os.path
+import ctypes
+import threading
+import Queue
 import wx
 
+import avisynth
+
 def autocrop(samples=10, tol=70, overcrop=True, insert=True, refresh=True, 
-             show_prompt=False):
+             threads=1, confidence=0, scan_step=1, var_step=0, select=False, 
+             cache_size=20, show_prompt=False):
     """Crop borders from the script in the current tab"""
     # Get options
     if show_prompt:
@@ -64,52 +99,88 @@ def autocrop(samples=10, tol=70, overcrop=True, insert=True, refresh=True,
         overcrop = avsp.Options.get('overcrop', overcrop)
         insert = avsp.Options.get('insert', insert)
         refresh = avsp.Options.get('refresh', refresh)
+        threads = avsp.Options.get('threads', threads)
+        confidence = avsp.Options.get('confidence', confidence)
+        scan_step = avsp.Options.get('scan_step', scan_step)
+        var_step = avsp.Options.get('var_step', var_step)
+        select = avsp.Options.get('select', select)
         options = avsp.GetTextEntry(
                 message=[[_('Samples'), _('Tolerance'), _('Overcrop')], 
-                         [_('Apply to script'), _('Update preview')]], 
+                         [_('Apply to script'), _('Update preview')], 
+                         _('Threads (1: analyze the preview clip)'), 
+                         _('Stop early with this confidence (%, 0: disabled)'), 
+                         _('Coarse scan step (1: disabled)'), 
+                         _('Variable borders: analyze every n-th frame (0: disabled)'), 
+                         _('Skip dark and flat frames')], 
                 default=[[(samples, 1, 100), (tol, 0, 255), overcrop], 
-                         [insert, refresh]], 
+                         [insert, refresh], (threads, 1, 64), (confidence, 0, 99), 
+                         (scan_step, 1, 64), (var_step, 0, None), select], 
                 title=_('Auto-crop'), 
-                types=[['spin', 'spin', 'check'], ['check', 'check']], 
+                types=[['spin', 'spin', 'check'], ['check', 'check'], 'spin', 'spin', 
+                       'spin', 'spin', 'check'], 
                 width=200)
         if not options:
             return
-        samples, tol, overcrop, insert, refresh = options
+        (samples, tol, overcrop, insert, refresh, threads, confidence, 
+         scan_step, var_step, select) = options
         avsp.Options['samples'] = samples
         avsp.Options['tol'] = tol
         avsp.Options['overcrop'] = overcrop
         avsp.Options['insert'] = insert
         avsp.Options['refresh'] = refresh
+        avsp.Options['threads'] = threads
+        avsp.Options['confidence'] = confidence
+        avsp.Options['scan_step'] = scan_step
+        avsp.Options['var_step'] = var_step
+        avsp.Options['select'] = select
 
-    # Get crop values for a number of frames
+    # Get crop values for a number of frames, or the ones from a previous run
     frames = avsp.GetVideoFramecount()
     avs = avsp.GetWindow().currentScript
     if not frames or avs.AVI.IsErrorClip():
         avsp.MsgBox(_('Error loading the script'), _('Error'))
         return
+    if var_step:
+        return autocrop_ranges(var_step, tol, overcrop, insert, refresh, threads, 
+                               scan_step, select)
     samples = min(samples, frames)
-    if samples <= 2:
-        frames = range(samples)
+    candidates = min(3 * samples, frames) if select else samples
+    cache_key = get_cache_key(samples, tol, confidence, scan_step, select)
+    cache = avsp.Options.get('cache', []) if cache_size else []
+    for i, (key, crop_value, crop_values) in enumerate(cache):
+        if key == cache_key:
+            cache.append(cache.pop(i))
+            break
     else:
-        def float_range(start=0, end=10, step=1):
-            '''Range with float step'''
-            while start < end:
-                yield int(round(start))
-                start += step
-        frames = float_range(frames/10, 9*frames/10 - 1, 8.0*frames/(10*samples))
-    progress = avsp.ProgressBox(samples, _('Analyzing frames...'), _('Auto-crop'))
-    crop_values = []
-    for i, frame in enumerate(frames):
-        if not progress.Update(i)[0]:
-            progress.Destroy()
+        if candidates <= 2:
+            frames = range(candidates)
+        else:
+            def float_range(start=0, end=10, step=1):
+                '''Range with float step'''
+                while start < end:
+                    yield int(round(start))
+                    start += step
+            frames = list(float_range(frames/10, 9*frames/10 - 1, 
+                                      8.0*frames/(10*candidates)))
+        if confidence or select:
+            frames = spread_order(frames)
+        crop_values = analyze_samples(frames, tol, threads, confidence, scan_step, 
+                                      select, samples)
+        if crop_values is None:
             return
-        crop_values.append(autocrop_frame(frame, tol))
-    progress.Destroy()
+        if not crop_values:
+            avsp.MsgBox(_('All the analyzed frames are dark or flat'), _('Error'))
+            return
+        crop_values = crop_values.values()
+        crop_value = [get_crop_value(seq) for seq in zip(*crop_values)]
+        if cache_size:
+            cache.append((cache_key, crop_value, crop_values))
+            del cache[:-cache_size]
+    avsp.Options['cache'] = cache
 
     # Get final crop values
     final_crop_values = []
-    for seq in zip(*crop_values):
-        value = get_crop_value(seq)
+    for value in crop_value:
         value = check_subsampling(value, avs.AVI.Colorspace, not len(final_crop_values) % 2, overcrop)
         final_crop_values.append(value)
     if insert:
@@ -119,72 +190,430 @@ def autocrop(samples=10, tol=70, overcrop=True, insert=True, refresh=True,
             avsp.ShowVideoFrame(forceRefresh=True)
     return final_crop_values
 
-def autocrop_frame(frame, tol=70):
-    """Return crop values for a specific frame"""
+def autocrop_ranges(step=250, tol=70, overcrop=True, insert=True, refresh=True, 
+                    threads=1, scan_step=1, select=False, min_length=3):
+    """Crop borders from the script in the current tab for every range of 
+    frames with different borders
+    
+    Every step-th frame of the clip is analyzed.  Ranges shorter than 
+    min_length analyzed frames are joined to the previous one, and the 
+    boundaries between ranges are refined with a binary search.  As the 
+    cropped ranges can't be spliced, the Trims are inserted commented 
+    out, to be used one at a time.  If select is True dark and flat 
+    frames are ignored.
+    """
+    frame_count = avsp.GetVideoFramecount()
+    colorspace = avsp.GetWindow().currentScript.AVI.Colorspace
+    frames = range(0, frame_count, step)
+    if frames[-1] != frame_count - 1:
+        frames.append(frame_count - 1)
+    crop_values = analyze_samples(frames, tol, threads, 0, scan_step, select)
+    if crop_values is None:
+        return
+    if not crop_values:
+        avsp.MsgBox(_('All the analyzed frames are dark or flat'), _('Error'))
+        return
+    frames = sorted(crop_values)
+    
+    # Group the frames in ranges with the same crop values
+    ranges = [] # [index of the first frame, index of the last frame, crop values]
+    for i, frame in enumerate(frames):
+        if ranges and crop_values[frame] == ranges[-1][2]:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i, crop_values[frame]])
+    i = 0
+    while len(ranges) > 1 and i < len(ranges):
+        if ranges[i][1] - ranges[i][0] + 1 >= min_length:
+            i += 1
+        elif i:
+            ranges[i-1][1] = ranges.pop(i)[1]
+        else:
+            first = ranges.pop(0)
+            ranges[0][0] = first[0]
+    i = 1
+    while i < len(ranges):
+        if ranges[i][2] == ranges[i-1][2]:
+            ranges[i-1][1] = ranges.pop(i)[1]
+        else:
+            i += 1
+    
+    # Search the first frame of every range
+    starts = [0]
+    if len(ranges) > 1:
+        progress = avsp.ProgressBox(len(ranges) - 1, _('Searching range boundaries...'), 
+                                    _('Auto-crop'))
+        for i, range_ in enumerate(ranges[1:]):
+            if not progress.Update(i)[0]:
+                progress.Destroy()
+                return
+            lo, hi = frames[ranges[i][1]], frames[range_[0]]
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                crop_value = autocrop_frame(mid, tol, scan_step, select)
+                if crop_value == ranges[i][2]:
+                    lo = mid
+                elif crop_value == range_[2]:
+                    hi = mid
+                else:
+                    break
+            starts.append(hi)
+        progress.Destroy()
+    
+    # Get final crop values
+    final_ranges = []
+    for i, range_ in enumerate(ranges):
+        final_crop_values = [check_subsampling(value, colorspace, not j % 2, overcrop) 
+                             for j, value in enumerate(range_[2])]
+        end = starts[i+1] - 1 if i + 1 < len(ranges) else frame_count - 1
+        final_ranges.append((starts[i], end, final_crop_values))
+    if insert:
+        txt = '' if avsp.GetText().endswith('\n') else '\n'
+        if len(final_ranges) == 1:
+            txt += 'Crop({0}, {1}, -{2}, -{3})'.format(*final_ranges[0][2])
+        else:
+            # Commented out, so the output of the script doesn't change
+            lines = []
+            for start, end, final_crop_values in final_ranges:
+                lines.append('#Trim({0}, {1}).Crop({2}, {3}, -{4}, -{5})'.format(
+                             start, end, *final_crop_values))
+            txt += '\n'.join(lines)
+        avsp.InsertText(txt)
+        if refresh:
+            avsp.ShowVideoFrame(forceRefresh=True)
+    return final_ranges
+
+def get_cache_key(samples=10, tol=70, confidence=0, scan_step=1, select=False):
+    """Return a hash of the script in the current tab and the settings that 
+    affect the crop values"""
+    self = avsp.GetWindow()
+    if self.version > '2.3.1':
+        text = avsp.GetText(clean=True)
+    else:
+        text = self.getCleanText(avsp.GetText())
+    key = u'\n'.join((avsp.GetScriptFilename(), unicode(samples), unicode(tol), 
+                      unicode(confidence), unicode(scan_step), unicode(select), 
+                      unicode(dark_threshold), unicode(flat_threshold), text))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def analyze_samples(frames, tol=70, threads=1, confidence=0, scan_step=1, 
+                    select=False, samples=None):
+    """Return a dict with the crop values of a list of frames, None if 
+    cancelled
+    
+    If select is True dark and flat frames are left out.  The analysis 
+    stops when the number of samples is reached, if given, or as soon as 
+    the values chosen by get_crop_value are settled if confidence is not 0.
+    """
+    if samples is None:
+        samples = len(frames)
+    progress = avsp.ProgressBox(len(frames), _('Analyzing frames...'), _('Auto-crop'))
+    crop_values = {}
+    crop_iter = iter_crop_values(frames, tol, threads, scan_step, select)
+    for i, (frame, crop_value) in enumerate(crop_iter):
+        if isinstance(crop_value, basestring):
+            crop_iter.close()
+            progress.Destroy()
+            avsp.MsgBox('\n\n'.join((_('Error loading the script'), crop_value)), _('Error'))
+            return
+        if crop_value is not None:
+            crop_values[frame] = crop_value
+        if not progress.Update(i + 1)[0]:
+            crop_iter.close()
+            progress.Destroy()
+            return
+        if len(crop_values) >= samples or crop_value is not None and confidence and all(
+                is_settled(seq, samples, confidence) for seq in zip(*crop_values.values())):
+            crop_iter.close()
+            break
+    progress.Destroy()
+    return crop_values
+
+def iter_crop_values(frames, tol=70, threads=1, scan_step=1, select=False):
+    """Yield (frame, crop values) for a list of frames, in order of completion
+    
+    If threads > 1 the script is evaluated in that number of independent 
+    AviSynth environments and the frames are analyzed concurrently.  The 
+    environments are created here, one after another, since loading a 
+    script changes the working directory of the whole process.  An 
+    error message is yielded instead of the crop values if the script 
+    can't be evaluated, None if select is True and the frame is dark or flat.
+    """
+    threads = min(threads, len(frames))
+    if threads <= 1:
+        for frame in frames:
+            yield frame, autocrop_frame(frame, tol, scan_step, select)
+        return
+    self = avsp.GetWindow()
+    if self.version > '2.3.1':
+        text = avsp.GetText(clean=True)
+    else:
+        text = self.getCleanText(avsp.GetText())
+    filename = avsp.GetScriptFilename()
+    clips = []
+    for i in range(threads):
+        clip = Clip(text, filename)
+        if clip.error is not None:
+            yield None, clip.error
+            return
+        clips.append(clip)
+    pending = Queue.Queue()
+    for frame in frames:
+        pending.put(frame)
+    results = Queue.Queue()
+    abort = threading.Event()
+    workers = []
+    for clip in clips:
+        worker = threading.Thread(target=analyze_frames, 
+                    args=(clip, pending, results, abort, tol, scan_step, select))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    try:
+        for i in range(len(frames)):
+            frame, crop_value = results.get()
+            yield frame, crop_value
+            if isinstance(crop_value, basestring):
+                break
+    finally:
+        abort.set()
+        for worker in workers:
+            worker.join()
+        del clip, clips
+
+def analyze_frames(clip, pending, results, abort, tol=70, scan_step=1, 
+                   select=False):
+    """Analyze frames from a queue in the AviSynth environment of a Clip"""
+    frame = None
+    try:
+        while not abort.isSet():
+            try:
+                frame = pending.get_nowait()
+            except Queue.Empty:
+                break
+            components = get_frame_components(clip.clip, frame)
+            if select and not is_informative(components, clip.vi.width, clip.vi.height):
+                results.put((frame, None))
+            else:
+                results.put((frame, find_borders(components, clip.vi.width, 
+                                                 clip.vi.height, tol, scan_step)))
+    except Exception, err:
+        results.put((frame, str(err)))
+
+def autocrop_frame(frame, tol=70, scan_step=1, select=False):
+    """Return crop values for a specific frame
+    
+    None is returned instead if select is True and the frame is dark or flat
+    """
     avs_clip = avsp.GetWindow().currentScript.AVI
     width, height = avs_clip.vi.width, avs_clip.vi.height
     version = avsp.GetWindow().version
-    if version > '2.3.1' or avs_clip.clipRaw is not None: # Get pixel color from the original clip
-        avs_clip._GetFrame(frame)
-        get_pixel_color = avs_clip.GetPixelRGB if avs_clip.IsRGB else avs_clip.GetPixelYUV
-    else: # Get pixel color from the video preview (slower)
+    if version > '2.3.1' or avs_clip.clipRaw is not None: # Get the frame from the original clip
+        raw_clip = avs_clip.clip if version > '2.3.1' else avs_clip.clipRaw
+        components = get_frame_components(raw_clip, frame)
+    else: # Get the frame from the video preview (slower)
         bmp = wx.EmptyBitmap(width, height)
         mdc = wx.MemoryDC()
         mdc.SelectObject(bmp)
         avs_clip.DrawFrame(frame, mdc.GetHDC())
-        img = bmp.ConvertToImage()
-        get_pixel_color = lambda x, y : (img.GetRed(x, y), img.GetGreen(x, y), img.GetBlue(x, y))
+        data = bmp.ConvertToImage().GetData()
+        components = [(data, 3 * width, i, 3, 0, 0, False) for i in (1, 0, 2)]
+    if select and not is_informative(components, width, height):
+        return
+    return find_borders(components, width, height, tol, scan_step)
+
+def get_frame_components(clip, frame):
+    """Copy the data of a frame from an AviSynth clip
+    
+    Return a list of (data, pitch, offset, step, width_shift, height_shift, 
+    bottom_up) tuples, one for each colour channel.  The first one is the 
+    luma, or green for RGB.
+    """
+    vi = clip.GetVideoInfo()
+    src = clip.GetFrame(frame)
+    components = []
+    if vi.IsPlanar():
+        for plane in (avisynth.PLANAR_Y, avisynth.PLANAR_U, avisynth.PLANAR_V):
+            row_size = src.GetRowSize(plane)
+            if not row_size: # Y8
+                break
+            pitch, rows = src.GetPitch(plane), src.GetHeight(plane)
+            data = ctypes.string_at(src.GetReadPtr(plane), pitch * (rows - 1) + row_size)
+            width_shift = {1: 0, 2: 1, 4: 2}[vi.width // row_size]
+            height_shift = {1: 0, 2: 1}[vi.height // rows]
+            components.append((data, pitch, 0, 1, width_shift, height_shift, False))
+    else:
+        pitch, row_size = src.GetPitch(), src.GetRowSize()
+        data = ctypes.string_at(src.GetReadPtr(), pitch * (src.GetHeight() - 1) + row_size)
+        if vi.IsYUY2():
+            components = [(data, pitch, 0, 2, 0, 0, False), 
+                          (data, pitch, 1, 4, 1, 0, False), 
+                          (data, pitch, 3, 4, 1, 0, False)]
+        else: # RGB24 or RGB32, stored upside down
+            step = vi.BitsPerPixel() >> 3
+            components = [(data, pitch, i, step, 0, 0, True) for i in (1, 0, 2)]
+    return components
+
+def find_borders(components, width, height, tol=70, scan_step=1):
+    """Return (left, top, right, bottom) borders of a frame
+    
+    Every colour channel is compared with the top-left (top and left 
+    borders) or bottom-right (bottom and right borders) pixel.  Whole 
+    rows and columns of samples are tested at once by deleting from them 
+    the values within the tolerance.
+    
+    If scan_step > 1 the borders are first located testing only every 
+    scan_step-th row, column and sample, and then refined at full 
+    resolution from the previous coarse line.  This is not exact: a line 
+    that only differs on the samples skipped by the coarse pass is taken 
+    as border, so with details smaller than the step the result may crop 
+    more than the full scan.
+    """
     w, h = width - 1, height - 1
-    top_left0, top_left1, top_left2 = get_pixel_color(0, 0)
-    bottom_right0, bottom_right1, bottom_right2 = get_pixel_color(w, h)
-    top = bottom = left = right = 0
-    
-    # top & bottom
-    top_done = bottom_done = False
-    for i in range(height):
-        for j in range(width):
-            if not top_done:
-                color0, color1, color2 = get_pixel_color(j, i)
-                if (abs(color0 - top_left0) > tol or 
-                    abs(color1 - top_left1) > tol or 
-                    abs(color2 - top_left2) > tol):
-                        top = i
-                        top_done = True
-            if not bottom_done:
-                color0, color1, color2 = get_pixel_color(j, h - i)
-                if (abs(color0 - bottom_right0) > tol or 
-                    abs(color1 - bottom_right1) > tol or 
-                    abs(color2 - bottom_right2) > tol):
-                        bottom = i
-                        bottom_done = True
-            if top_done and bottom_done: break
-        else: continue
-        break
-    
-    # left & right
-    left_done = right_done = False
-    for j in range(width):
-        for i in range(height):
-            if not left_done:
-                color0, color1, color2 = get_pixel_color(j, i)
-                if (abs(color0 - top_left0) > tol or 
-                    abs(color1 - top_left1) > tol or 
-                    abs(color2 - top_left2) > tol):
-                        left = j
-                        left_done = True
-            if not right_done:
-                color0, color1, color2 = get_pixel_color(w - j, i)
-                if (abs(color0 - bottom_right0) > tol or 
-                    abs(color1 - bottom_right1) > tol or 
-                    abs(color2 - bottom_right2) > tol):
-                        right = j
-                        right_done = True
-            if left_done and right_done: break
-        else: continue
-        break
+    channels = []
+    for data, pitch, offset, step, width_shift, height_shift, bottom_up in components:
+        sample_width = (width + (1 << width_shift) - 1) >> width_shift
+        sample_height = (height + (1 << height_shift) - 1) >> height_shift
+        def row_start(y, pitch=pitch, offset=offset, sample_height=sample_height, 
+                      bottom_up=bottom_up):
+            if bottom_up:
+                y = sample_height - 1 - y
+            return y * pitch + offset
+        ref_chars = []
+        for x, y in ((0, 0), (sample_width - 1, sample_height - 1)):
+            value = ord(data[row_start(y) + x * step])
+            ref_chars.append(''.join(chr(i) for i in 
+                             range(max(0, value - tol), min(255, value + tol) + 1)))
+        channels.append((data, pitch, offset, step, width_shift, height_shift, 
+                         sample_width * step, row_start, ref_chars))
+    
+    # The decimated lines also include their last sample, where the 
+    # opposite border is
+    def row_differs(y, ref, decimation=1):
+        for (data, pitch, offset, step, width_shift, height_shift, row_size, 
+             row_start, ref_chars) in channels:
+            start = row_start(y >> height_shift)
+            samples = data[start:start+row_size:step*max(1, decimation >> width_shift)]
+            if decimation > 1:
+                samples += data[start+row_size-step]
+            if samples.translate(None, ref_chars[ref]):
+                return True
+        return False
     
+    def column_differs(x, ref, decimation=1):
+        for (data, pitch, offset, step, width_shift, height_shift, row_size, 
+             row_start, ref_chars) in channels:
+            start = offset + (x >> width_shift) * step
+            samples = data[start::pitch*max(1, decimation >> height_shift)]
+            if decimation > 1:
+                samples += data[start+(len(data)-1-start)//pitch*pitch]
+            if samples.translate(None, ref_chars[ref]):
+                return True
+        return False
+    
+    def scan(differs, count):
+        """Return the first index for which differs is true, 0 if none"""
+        if scan_step > 1:
+            for i in range(0, count, scan_step):
+                if differs(i, scan_step):
+                    for j in range(max(0, i - scan_step), i + 1):
+                        if differs(j):
+                            return j
+        for i in range(count):
+            if differs(i):
+                return i
+        return 0
+    
+    top = scan(lambda i, decimation=1: row_differs(i, 0, decimation), height)
+    bottom = scan(lambda i, decimation=1: row_differs(h - i, 1, decimation), height)
+    left = scan(lambda j, decimation=1: column_differs(j, 0, decimation), width)
+    right = scan(lambda j, decimation=1: column_differs(w - j, 1, decimation), width)
     return left, top, right, bottom
 
+def is_informative(components, width, height, decimation=16):
+    """Check if a frame is not too dark or flat for detecting its borders
+    
+    Only every decimation-th row and sample of the first channel of the 
+    frame are taken into account.
+    """
+    data, pitch, offset, step = components[0][:4]
+    row_size = width * step
+    values = bytearray()
+    for y in range(0, height, decimation):
+        start = y * pitch + offset
+        values.extend(data[start:start+row_size:step*decimation])
+    average = float(sum(values)) / len(values)
+    deviation = max(0, sum(value * value for value in values) / float(len(values)) - 
+                       average * average) ** 0.5
+    return average >= dark_threshold and deviation >= flat_threshold
+
+def spread_order(seq):
+    """Reorder a sequence so every beginning of it is spread over the whole 
+    sequence (bit-reversal permutation)"""
+    bits = 0
+    while (1 << bits) < len(seq):
+        bits += 1
+    if not bits:
+        return list(seq)
+    ret = []
+    for i in range(1 << bits):
+        j = int('{0:0{1}b}'.format(i, bits)[::-1], 2)
+        if j < len(seq):
+            ret.append(seq[j])
+    return ret
+
+def is_settled(seq, total, confidence=95):
+    """Check if the most repeated value on a sequence is going to be the 
+    one chosen by get_crop_value
+    
+    That's sure if it already repeats more than 50% of the total number of 
+    values, and it's assumed if a one-sided binomial test rejects it 
+    repeating 50% or less with the given confidence (%)
+    """
+    d = defaultdict(int)
+    for i in seq:
+        d[i] += 1
+    n, k = len(seq), max(d.values())
+    if k > total / 2:
+        return True
+    p_value, term = 0.0, 0.5 ** n
+    for i in range(n + 1):
+        if i >= k:
+            p_value += term
+        term = term * (n - i) / (i + 1)
+    return p_value <= 1 - confidence / 100.0
+
+class Clip(object):
+    '''Basic avs script loading class'''
+    
+    def __init__(self, text, filename=''):
+        self.error = None
+        self.env = avisynth.avs_create_script_environment(3)
+        curdir = os.getcwdu()
+        dirname, basename = os.path.split(filename)
+        if os.path.isdir(dirname):
+            self.env.SetWorkingDir(dirname)
+        self.file = avisynth.AVS_Value(filename)
+        self.name = avisynth.AVS_Value(basename)
+        self.dir = avisynth.AVS_Value(dirname)
+        self.env.SetGlobalVar("$ScriptFile$", self.file)
+        self.env.SetGlobalVar("$ScriptName$", self.name)
+        self.env.SetGlobalVar("$ScriptDir$", self.dir)
+        try:
+            clip = self.env.Invoke('Eval', avisynth.AVS_Value(text), 0)
+        except avisynth.AvisynthError, err:
+            self.error = str(err)
+            os.chdir(curdir)
+            return
+        self.clip = clip.AsClip(self.env)
+        self.vi = self.clip.GetVideoInfo()
+        os.chdir(curdir)
+    
+    def __del__(self):
+        if hasattr(self, 'clip'):
+            self.clip.Release()
+        self.env.Release()
+
 def get_crop_value(seq):
     """Get the most repeated value on a sequence if it repeats more than 50%, 
     the minimum value otherwise"""
@@ -221,4 +650,5 @@ def check_subsampling(value, colorspace, horizontal, overcrop):
                     value -= 1
             return value
 
-return autocrop(samples, tol, overcrop, insert, refresh, show_prompt)
+return autocrop(samples, tol, overcrop, insert, refresh, threads, confidence, 
+                scan_step, var_step, select, cache_size, show_prompt)
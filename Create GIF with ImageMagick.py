@@ -7,12 +7,44 @@ optionally trimmed by adding pairs of bookmarks and selecting the 'only
 range between bookmarks' option. The GIF creation may take a while for 
 long clips.
 
+Frames equal to the previous one can be dropped, extending the duration 
+of the previous frame instead.  With a tolerance of 0 only identical 
+frames are dropped, otherwise the frames that don't differ more than that 
+value at any byte.
+
+With 'drop frames with little motion' the frames are compared with the 
+last one kept on a decimated copy of them, and dropped if the mean 
+difference per byte doesn't exceed the threshold.  Static stretches of 
+the clip then take a single frame, so the time needed and the size of the 
+GIF depend on the amount of motion instead of the length of the clip.
+
+The frames are read directly from AviSynth, not from the video preview.  
+Clips that aren't RGB24 are converted with the selected matrix.
+
+Instead of letting ImageMagick choose a palette for every frame, a single 
+one can be built from a sample of frames and used for all of them 
+(-remap).  It's faster and avoids palette flickering.  The dithering 
+option is applied when remapping to that palette.
+
+Only the area of every frame that changed from the previous one can be 
+sent to ImageMagick, as a sub-image with its offset on the canvas.  This 
+is faster for mostly static clips, e.g. screen captures.  The 'optimize' 
+option is not usually needed in that case, as it makes ImageMagick 
+rebuild the whole frames first.
+
+The GIF can also be written by the macro itself instead of ImageMagick 
+('Built-in' encoder).  The frames are mapped to a global palette, without 
+dithering, and written to disk as they are read, so memory usage doesn't 
+grow with the length of the clip.  The additional parameters are ignored 
+in that case.
+
 For loading/saving other formats with ImageMagick check out Wilbert's 
 Immaavs AviSynth plugin <http://www.wilbertdijkhof.com>
 
 
 Requirements:
-- 'convert' executable from ImageMagick <http://www.imagemagick.org>
+- 'convert' executable from ImageMagick <http://www.imagemagick.org>, 
+  unless the built-in encoder is used
 
 
 Windows installation:
@@ -32,7 +64,7 @@ If you only need ImageMagick for this macro then do the following:
 Just install ImageMagick on your system.
 
 
-Date: 2013-04-26
+Date: 2026-10-16
 Latest version:  https://github.com/vdcrim/avsp-macros
 
 Changelog:
@@ -40,6 +72,12 @@ Changelog:
 - AvxSynth compatibility
 - fix Python 2.6 compatibility
 - show error if the GIF creation fails and 'notify' is checked
+- add option to drop duplicate frames
+- read the frames directly from AviSynth instead of the video preview
+- add option to use a single palette for all the frames
+- add option to send only the area that changed from the previous frame
+- add built-in GIF encoder
+- add option to drop frames with little motion
 
 
 Copyright (C) 2012, 2013  Diego Fernández Gosende <dfgosende@gmail.com>
@@ -67,9 +105,24 @@ with this program.  If not, see <http://www.gnu.org/licenses/gpl-2.0.html>.
 import os
 import os.path
 import sys
+import re
+import struct
 import subprocess
 import shlex
-import wx
+import tempfile
+from collections import defaultdict
+import ctypes
+import zlib
+import audioop
+
+import avisynth
+
+try:
+    buffer_view = memoryview
+    view_bytes = memoryview.tobytes
+except NameError: # Python 2.6
+    buffer_view = buffer
+    view_bytes = str
 
 def check_executable_path(executable, check_PATH_Windows=True, check_PATH_nix=False, 
                           error_message=None):
@@ -118,23 +171,339 @@ def check_executable_path(executable, check_PATH_Windows=True, check_PATH_nix=Fa
         error_message = _("{0} not found").format(executable)
     return prompt_path(executable, error_message)
 
-self = avsp.GetWindow()
+class Clip(object):
+    '''Basic avs script loading class with raw RGB24 output
+    
+    The clip is converted to RGB24 with the given matrix if it's not 
+    already, and reordered (BGR to RGB, bottom-up to top-down) when copying 
+    the frame
+    
+    The frames are copied to a preallocated buffer, so the data returned 
+    by raw_frame is only valid until the next frame is requested
+    
+    '''
+    def __init__(self, text, filename='', matrix='Rec601'):
+        self.error = None
+        self.env = avisynth.avs_create_script_environment(3)
+        curdir = os.getcwdu()
+        dirname, basename = os.path.split(filename)
+        if os.path.isdir(dirname):
+            self.env.SetWorkingDir(dirname)
+        self.file = avisynth.AVS_Value(filename)
+        self.name = avisynth.AVS_Value(basename)
+        self.dir = avisynth.AVS_Value(dirname)
+        self.env.SetGlobalVar("$ScriptFile$", self.file)
+        self.env.SetGlobalVar("$ScriptName$", self.name)
+        self.env.SetGlobalVar("$ScriptDir$", self.dir)
+        try:
+            clip = self.env.Invoke('Eval', avisynth.AVS_Value(text), 0)
+            self.clip = clip.AsClip(self.env)
+            self.vi = self.clip.GetVideoInfo()
+            if not self.vi.IsRGB24():
+                args = avisynth.AVS_Value([avisynth.AVS_Value(self.clip), 
+                                           avisynth.AVS_Value(matrix)])
+                clip = self.env.Invoke('ConvertToRGB24', args, 0)
+                self.clip.Release()
+                self.clip = clip.AsClip(self.env)
+                self.vi = self.clip.GetVideoInfo()
+        except avisynth.AvisynthError, err:
+            self.error = str(err)
+            os.chdir(curdir)
+            return
+        os.chdir(curdir)
+        self.buffer = bytearray(self.vi.width * self.vi.height * 3)
+        self.c_buffer = (ctypes.c_ubyte * len(self.buffer)).from_buffer(self.buffer)
+    
+    def raw_frame(self, frame):
+        '''Get a buffer of RGB24 data'''
+        frame = self.clip.GetFrame(frame)
+        buf = self.buffer
+        # AviSynth stores RGB bottom-up and as BGR.  Copy the rows in 
+        # reverse order and swap the blue and red bytes afterwards
+        row_size = frame.GetRowSize()
+        pitch = frame.GetPitch()
+        height = frame.GetHeight()
+        write_addr = ctypes.addressof(self.c_buffer)
+        read_addr = ctypes.cast(frame.GetReadPtr(), ctypes.c_void_p).value
+        read_addr += pitch * (height - 1)
+        for row in range(height):
+            ctypes.memmove(write_addr, read_addr, row_size)
+            write_addr += row_size
+            read_addr -= pitch
+        blue = buf[0::3]
+        buf[0::3] = buf[2::3]
+        buf[2::3] = blue
+        return buffer_view(buf)
+    
+    def __del__(self):
+        if hasattr(self, 'clip'):
+            self.clip.Release()
+        self.env.Release()
 
-# Check convert path
-convert_path = avsp.Options.get('convert_path', '')
-if not os.path.isfile(convert_path):
-    if not check_executable_path('convert', False, True,
-                                 _("'convert' from ImageMagick not found")):
-        return
-    convert_path = avsp.Options['convert_path']
+class DuplicateFilter(object):
+    '''Tell if a frame is equal to the last one that wasn't a duplicate
+    
+    If tolerance is not 0 the frames are compared byte by byte, and 
+    they're considered equal if no difference is bigger than it.  Otherwise 
+    only the CRC-32 of the frames is compared
+    
+    '''
+    def __init__(self, tolerance=0):
+        self.tolerance = tolerance
+        self.reset()
+    
+    def reset(self):
+        '''Forget the last frame'''
+        self.last = None
+        self.last_frame = None
+    
+    def duplicate_of(self, frame, data):
+        '''Return the number of the frame this one duplicates, or None'''
+        data = view_bytes(data)
+        if self.tolerance:
+            # audioop works on signed samples, so convert the bytes first.  
+            # They're widened to 16-bit and halved (value * 128), so the 
+            # difference can't saturate
+            data = audioop.mul(audioop.lin2lin(audioop.bias(data, 1, -128), 1, 2), 
+                               2, 0.5)
+            duplicate = self.last is not None and audioop.max(audioop.add(
+                data, audioop.mul(self.last, 2, -1), 2), 2) <= self.tolerance * 128
+        else:
+            data = zlib.crc32(data)
+            duplicate = data == self.last
+        if duplicate:
+            return self.last_frame
+        self.last = data
+        self.last_frame = frame
+
+class MotionFilter(object):
+    '''Tell if a frame barely changed from the last one that was kept
+    
+    The frames are compared on a decimated copy of about 'samples' bytes.  
+    The step between samples isn't a multiple of 3, so all the RGB channels 
+    are taken into account.  A frame is static if the mean absolute 
+    difference of the samples is not bigger than the threshold.
+    
+    '''
+    def __init__(self, threshold, frame_size, samples=30000):
+        self.threshold = threshold
+        self.step = 3 * (frame_size // (3 * samples)) + 1
+        self.last = None
+    
+    def is_static(self, data):
+        '''Return True if the frame should be dropped'''
+        sample = bytearray(view_bytes(data)[::self.step])
+        if self.last is not None:
+            difference = sum([abs(a - b) for a, b in zip(sample, self.last)])
+            if difference <= self.threshold * len(sample):
+                return True
+        self.last = sample
+        return False
+
+def median_cut(histogram, colors=256):
+    '''Return a palette of up to 'colors' (r, g, b) for a {(r, g, b): count} dict
+    
+    The box of colours with the biggest product of channel range and 
+    population is split on every step, at the weighted median of its widest 
+    channel.  The palette entries are the weighted mean of each box.
+    '''
+    def box_info(box):
+        population = sum([count for color, count in box])
+        ranges = [max([color[c] for color, count in box]) - 
+                  min([color[c] for color, count in box]) for c in range(3)]
+        channel = ranges.index(max(ranges))
+        return ranges[channel] * population, channel, population, box
+    
+    boxes = [box_info(histogram.items())]
+    while len(boxes) < colors:
+        boxes.sort(key=lambda box: box[0])
+        score, channel, population, box = boxes[-1]
+        if not score:
+            break
+        box.sort(key=lambda item: item[0][channel])
+        accumulated = 0
+        for i, (color, count) in enumerate(box):
+            accumulated += count
+            if accumulated * 2 >= population:
+                break
+        i = min(max(i, 0), len(box) - 2) + 1
+        boxes[-1:] = [box_info(box[:i]), box_info(box[i:])]
+    palette = []
+    for score, channel, population, box in boxes:
+        palette.append(tuple([int(round(float(sum([color[c] * count for color, count in box]))
+                                        / population)) for c in range(3)]))
+    return palette
+
+def changed_area(data, previous, width, height):
+    '''Return the (left, top, right, bottom) box of the pixels that changed
+    
+    data and previous are RGB24 frames.  The whole frame is returned if 
+    previous is None, and the top-left pixel if nothing changed.
+    '''
+    if previous is None:
+        return 0, 0, width - 1, height - 1
+    row_size = width * 3
+    top = 0
+    while top < height and (data[top*row_size:(top+1)*row_size] == 
+                            previous[top*row_size:(top+1)*row_size]):
+        top += 1
+    if top == height:
+        return 0, 0, 0, 0
+    bottom = height - 1
+    while (data[bottom*row_size:(bottom+1)*row_size] == 
+           previous[bottom*row_size:(bottom+1)*row_size]):
+        bottom -= 1
+    rows = [(data[y*row_size:(y+1)*row_size], previous[y*row_size:(y+1)*row_size]) 
+            for y in range(top, bottom + 1)]
+    # Binary search of the widest run of unchanged columns on each side
+    lo, hi = 0, width
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if all([row[:mid*3] == previous_row[:mid*3] for row, previous_row in rows]):
+            lo = mid
+        else:
+            hi = mid
+    left = lo
+    lo, hi = 0, width
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if all([row[-mid*3:] == previous_row[-mid*3:] for row, previous_row in rows]):
+            lo = mid
+        else:
+            hi = mid
+    right = width - 1 - lo
+    return left, top, right, bottom
+
+class PaletteMap(dict):
+    '''Cache of the palette index (as a byte) of every RGB24 colour
+    
+    The keys are colours quantized to 5 bits per channel, so the nearest 
+    palette entry is only searched once per bin.
+    '''
+    quantize = ''.join([chr(i & 0xf8 | 4) for i in range(256)])
+    
+    def __init__(self, palette):
+        dict.__init__(self)
+        self.palette = palette
+    
+    def __missing__(self, color):
+        r, g, b = bytearray(color)
+        distances = [(r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2 
+                     for pr, pg, pb in self.palette]
+        index = self[color] = chr(distances.index(min(distances)))
+        return index
+
+def lzw_encode(data, min_code_size):
+    '''Return the GIF LZW compressed stream of a string of palette indices'''
+    clear = 1 << min_code_size
+    end = clear + 1
+    output = bytearray()
+    bits = [0, 0] # bit buffer, number of bits in it
+    def emit(code, code_size):
+        buffer = bits[0] | code << bits[1]
+        count = bits[1] + code_size
+        while count >= 8:
+            output.append(buffer & 0xff)
+            buffer >>= 8
+            count -= 8
+        bits[:] = buffer, count
+    initial_codes = dict([(chr(i), i) for i in range(clear)])
+    codes = initial_codes.copy()
+    next_code = end + 1
+    code_size = min_code_size + 1
+    emit(clear, code_size)
+    prefix = ''
+    for char in data:
+        string = prefix + char
+        if string in codes:
+            prefix = string
+            continue
+        emit(codes[prefix], code_size)
+        if next_code == 4096:
+            # Table full, start again
+            emit(clear, code_size)
+            codes = initial_codes.copy()
+            next_code = end + 1
+            code_size = min_code_size + 1
+        else:
+            codes[string] = next_code
+            if next_code == 1 << code_size:
+                code_size += 1
+            next_code += 1
+        prefix = char
+    if prefix:
+        emit(codes[prefix], code_size)
+    emit(end, code_size)
+    if bits[1]:
+        output.append(bits[0])
+    return str(output)
+
+class GifWriter(object):
+    '''Write an animated GIF frame by frame, using a single global palette'''
+    
+    def __init__(self, path, width, height, palette, loops=0):
+        self.file = open(path, 'wb')
+        self.width = width
+        self.height = height
+        self.palette_map = PaletteMap(palette)
+        bits = 1
+        while 1 << bits < len(palette):
+            bits += 1
+        self.min_code_size = max(2, bits)
+        color_table = ''.join([chr(r) + chr(g) + chr(b) for r, g, b in palette])
+        color_table += '\0' * (3 * (1 << bits) - len(color_table))
+        self.file.write('GIF89a' + struct.pack('<HHBBB', width, height, 
+                        0xf0 | bits - 1, 0, 0) + color_table)
+        # Netscape looping extension
+        self.file.write('\x21\xff\x0bNETSCAPE2.0\x03\x01' + 
+                        struct.pack('<H', loops) + '\0')
+    
+    def add_frame(self, box, data, delay):
+        '''Add the RGB24 data of the (left, top, right, bottom) box of a frame
+        
+        The area outside the box keeps the previous frame (disposal method 1).
+        '''
+        left, top, right, bottom = box
+        data = data.translate(PaletteMap.quantize)
+        palette_map = self.palette_map
+        indices = ''.join([palette_map[color] for color in 
+                           re.findall('...', data, re.S)])
+        write = self.file.write
+        # Graphic control extension: disposal method, delay
+        write('\x21\xf9\x04\x04' + struct.pack('<H', max(0, delay)) + '\0\0')
+        # Image descriptor, no local colour table
+        write('\x2c' + struct.pack('<HHHHB', left, top, right - left + 1, 
+                                   bottom - top + 1, 0))
+        write(chr(self.min_code_size))
+        stream = lzw_encode(indices, self.min_code_size)
+        for i in range(0, len(stream), 255):
+            block = stream[i:i+255]
+            write(chr(len(block)) + block)
+        write('\0')
+    
+    def close(self):
+        if not self.file.closed:
+            self.file.write(';')
+            self.file.close()
+
+self = avsp.GetWindow()
 
 # Prompt for options
 speed_factor = avsp.Options.get('speed_factor', 2)
 select_every = avsp.Options.get('select_every', 4)
 loops = avsp.Options.get('loops', 0)
+backend = avsp.Options.get('backend', 'ImageMagick')
 use_bm_only = avsp.Options.get('use_bm_only', True)
+skip_duplicates = avsp.Options.get('skip_duplicates', False)
+duplicate_tolerance = avsp.Options.get('duplicate_tolerance', 0)
+motion_adaptive = avsp.Options.get('motion_adaptive', False)
+motion_threshold = avsp.Options.get('motion_threshold', 2.0)
+crop_changes = avsp.Options.get('crop_changes', False)
+matrix = avsp.Options.get('matrix', 'Rec601')
 dither = avsp.Options.get('dither', _('Ordered + Error correction'))
 optimize = avsp.Options.get('optimize', False)
+global_palette = avsp.Options.get('global_palette', False)
+palette_frames = avsp.Options.get('palette_frames', 16)
 add_params = avsp.Options.get('add_params', '')
 notify_at_end = avsp.Options.get('notify_at_end', True)
 dither_list = [_('None'), _('Riemersma'), _('Floyd-Steinberg'), _('Ordered'), 
@@ -158,20 +527,37 @@ while True:
     options = avsp.GetTextEntry(
             title=_('Create GIF with ImageMagick'),
             message=[[_('Speed factor'), _('Select every'), _('Loops (0: infinite)')], 
+                     _('Encoder'), 
                      _('Include only the range between bookmarks, if any'), 
+                     [_('Drop frames equal to the previous one'), 
+                      _('Tolerance (0: identical)')], 
+                     [_('Drop frames with little motion'), 
+                      _('Threshold (mean difference)')], 
+                     _('Send only the area that changed from the previous frame'), 
+                     _('Matrix for the conversion to RGB, if needed'), 
                      [_('Dithering'), _('Optimize')], 
+                     [_('Use a single palette for all the frames'), 
+                      _('Number of frames sampled')], 
                      _('Additional parameters (applied before dithering)'),
                      [_('Save current settings as default'), _('Notify when finished')],  
                      _('Output GIF path')
                     ], 
             default=[[(speed_factor, 0, None, 2, 0.25), 
                       (select_every, 1), (loops, 0)], 
+                     ['ImageMagick', _('Built-in'), backend], 
                      use_bm_only, 
+                     [skip_duplicates, (duplicate_tolerance, 0, 100)], 
+                     [motion_adaptive, (motion_threshold, 0, 255, 1, 0.5)], 
+                     crop_changes, 
+                     ['Rec601', 'Rec709', 'PC.601', 'PC.709', matrix], 
                      [dither_list + [dither], optimize], 
+                     [global_palette, (palette_frames, 1, 1000)], 
                      add_params, [False, notify_at_end], (output_path, gif_filter)
                     ], 
-            types=[['spin', 'spin', 'spin'], 'check', ['list_read_only', 'check'], 
-                   '', ['check', 'check'], 'file_save'],
+            types=[['spin', 'spin', 'spin'], 'list_read_only', 'check', 
+                   ['check', 'spin'], ['check', 'spin'], 'check', 'list_read_only', 
+                   ['list_read_only', 'check'], ['check', 'spin'], '', 
+                   ['check', 'check'], 'file_save'],
             width=350) 
     if not options:
         return
@@ -183,29 +569,65 @@ while True:
 speed_factor = options[0]
 select_every = options[1]
 loops = options[2]
-use_bm_only = options[3]
-dither = options[4]
-optimize = '-layers optimize' if options[5] else ''
-add_params = options[6]
-save_defaults = options[7]
-notify_at_end = options[8]
+backend = options[3]
+use_bm_only = options[4]
+skip_duplicates = options[5]
+duplicate_tolerance = options[6]
+motion_adaptive = options[7]
+motion_threshold = options[8]
+crop_changes = options[9]
+matrix = options[10]
+dither = options[11]
+optimize = '-layers optimize' if options[12] else ''
+global_palette = options[13]
+palette_frames = options[14]
+add_params = options[15]
+save_defaults = options[16]
+notify_at_end = options[17]
 output_path = options[-1]
 if save_defaults:
     avsp.Options['speed_factor'] = speed_factor
     avsp.Options['select_every'] = select_every
     avsp.Options['loops'] = loops
+    avsp.Options['backend'] = backend
     avsp.Options['use_bm_only'] = use_bm_only
+    avsp.Options['skip_duplicates'] = skip_duplicates
+    avsp.Options['duplicate_tolerance'] = duplicate_tolerance
+    avsp.Options['motion_adaptive'] = motion_adaptive
+    avsp.Options['motion_threshold'] = motion_threshold
+    avsp.Options['crop_changes'] = crop_changes
+    avsp.Options['matrix'] = matrix
     avsp.Options['dither'] = dither
     avsp.Options['optimize'] = bool(optimize)
+    avsp.Options['global_palette'] = global_palette
+    avsp.Options['palette_frames'] = palette_frames
     avsp.Options['add_params'] = add_params
     avsp.Options['notify_at_end'] = notify_at_end
-delay = float(100) / avsp.GetVideoFramerate() * select_every / speed_factor
-avs = self.currentScript
-width = avsp.GetVideoWidth()
-height = avsp.GetVideoHeight()
-header='id=ImageMagick columns={0} rows={1}\n\f:\x1A'.format(width, height)
+
+# Check convert path
+builtin = backend == _('Built-in')
+convert_path = avsp.Options.get('convert_path', '')
+if not builtin and not os.path.isfile(convert_path):
+    if not check_executable_path('convert', False, True,
+                                 _("'convert' from ImageMagick not found")):
+        return
+    convert_path = avsp.Options['convert_path']
+
+# Load the script, without going through the video preview
+if self.version > '2.3.1':
+    text = avsp.GetText(clean=True)
+else:
+    text = self.getCleanText(avsp.GetText())
+clip = Clip(text, avsp.GetScriptFilename() or '', matrix)
+if clip.error is not None:
+    avsp.MsgBox('\n\n'.join((_('Error loading the script'), clip.error)), _('Error'))
+    return
+fps = float(clip.vi.fps_numerator) / clip.vi.fps_denominator
+delay = float(100) / fps * select_every / speed_factor
+width = clip.vi.width
+height = clip.vi.height
+frame_count = clip.vi.num_frames
 if use_bm_only:
-    frame_count = avsp.GetVideoFramecount()
     bmlist = sorted([bm for bm in avsp.GetBookmarkList() if bm < frame_count])
     if not bmlist:
         gif_range = range(0, frame_count, select_every)
@@ -221,9 +643,36 @@ if use_bm_only:
             if i%2:
                 gif_range.extend(range(bmlist[i-1], bm+1, select_every))
 else:
-    gif_range = range(0, avsp.GetVideoFramecount(), select_every)
+    gif_range = range(0, frame_count, select_every)
+if not gif_range:
+    avsp.MsgBox(_('There are no frames to save'), _('Error'))
+    return
 
-# Pipe the image data to convert.exe as a multi-image miff file
+# Build a global palette from a sample of the pixels of some frames spread 
+# over the GIF range.  It's always needed by the built-in encoder.  For 
+# ImageMagick it's saved as a 1 pixel high image for -remap
+if global_palette or builtin:
+    histogram = defaultdict(int)
+    sample = set([gif_range[i * len(gif_range) // palette_frames] 
+                  for i in range(palette_frames)])
+    # About 100000 pixels in total
+    step = 3 * max(1, width * height * len(sample) // 100000)
+    for frame in sorted(sample):
+        data = view_bytes(clip.raw_frame(frame))
+        for pixel in zip(bytearray(data[0::step]), bytearray(data[1::step]), 
+                         bytearray(data[2::step])):
+            histogram[pixel] += 1
+    palette = median_cut(histogram)
+remap = ''
+if global_palette and not builtin:
+    fd, palette_path = tempfile.mkstemp(suffix='.ppm')
+    with os.fdopen(fd, 'wb') as f:
+        f.write('P6\n{0} 1\n255\n'.format(len(palette)))
+        f.write(''.join([chr(r) + chr(g) + chr(b) for r, g, b in palette]))
+    remap = u'-remap "{0}"'.format(palette_path)
+
+# Pipe the image data to convert.exe as a multi-image miff file, or write 
+# it directly with the built-in encoder
 
 # - Issue 1: Python 2.x doesn't support unicode args in subprocess.Popen()
 #   http://bugs.python.org/issue1759845
@@ -234,46 +683,114 @@ else:
 #   http://www.py2exe.org/index.cgi/Py2ExeSubprocessInteractions
 #   http://bugs.python.org/issue3905
 #   http://bugs.python.org/issue1124861
-code = sys.getfilesystemencoding()
-cmd = ur'"{0}" miff:- -dispose None -loop {1} -set delay {2} {3} {4} {5} "{6}"'.format(
-      convert_path, loops, delay, add_params, dither_dict[dither], optimize, 
-      output_path).encode(code)
-cmd = shlex.split(cmd)
-if os.name == 'nt':
-    info = subprocess.STARTUPINFO()
+#
+# The delay is set for every frame, rounding the accumulated time so the 
+# total duration doesn't drift
+def frame_delay(start, end):
+    '''Delay of a frame shown from the start to the end position on gif_range'''
+    return int(round(end * delay)) - int(round(start * delay))
+
+def miff_header(left, top, right, bottom, delay):
+    '''Return the MIFF header of a frame, or an area of it'''
+    header = 'id=ImageMagick columns={0} rows={1} delay={2}'.format(
+                right - left + 1, bottom - top + 1, delay)
+    if crop_changes:
+        header += ' page={0}x{1}+{2}+{3}'.format(width, height, left, top)
+    return header + '\n\f:\x1A'
+
+if builtin:
     try:
-        info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        info.wShowWindow = subprocess.SW_HIDE
-    except AttributeError:
-        import _subprocess
-        info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
-        info.wShowWindow = _subprocess.SW_HIDE
-    cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                           stderr=subprocess.STDOUT, startupinfo=info)
+        gif = GifWriter(output_path, width, height, palette, loops)
+    except IOError, err:
+        avsp.MsgBox(str(err), _('Error'))
+        return
+    write_frame = gif.add_frame
 else:
-    cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                           stderr=subprocess.STDOUT)
+    # The palette file is otherwise removed after 'convert' finishes
+    try:
+        code = sys.getfilesystemencoding()
+        if crop_changes and optimize:
+            # -layers optimize expects whole frames
+            optimize = '-coalesce ' + optimize
+        cmd = ur'"{0}" miff:- -dispose None -loop {1} {2} {3} {4} {5} "{6}"'.format(
+              convert_path, loops, add_params, dither_dict[dither], remap, optimize, 
+              output_path).encode(code)
+        cmd = shlex.split(cmd)
+        if os.name == 'nt':
+            info = subprocess.STARTUPINFO()
+            try:
+                info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                info.wShowWindow = subprocess.SW_HIDE
+            except AttributeError:
+                import _subprocess
+                info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
+                info.wShowWindow = _subprocess.SW_HIDE
+            cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                   stderr=subprocess.STDOUT, startupinfo=info)
+        else:
+            cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                   stderr=subprocess.STDOUT)
+    except:
+        if remap:
+            os.remove(palette_path)
+        raise
+    def write_frame(box, data, delay):
+        cmd.stdin.write(miff_header(*box, delay=delay))
+        cmd.stdin.write(data)
+
+# Every frame is written when the next one that is not dropped is found, 
+# as its delay is not known until then
 try:
-    for frame in gif_range:
-        avsp.ShowVideoFrame(frame)
-        bmp = wx.EmptyBitmap(width, height)
-        mdc = wx.MemoryDC()
-        mdc.SelectObject(bmp)
-        dc = mdc if avsp.GetWindow().version > '2.3.1' else mdc.GetHDC()
-        avs.AVI.DrawFrame(frame, dc)
-        img = bmp.ConvertToImage()
-        cmd.stdin.write(header + img.GetData())
-    cmd.stdin.close()
-    avsp.HideVideoWindow()
-    if notify_at_end:
-        if cmd.wait():
-            avsp.MsgBox(_('GIF creation failed!') +'\n\n' + cmd.stdout.read(), 
-                        _('Error'))
+    duplicate_filter = DuplicateFilter(duplicate_tolerance)
+    motion_filter = MotionFilter(motion_threshold, width * height * 3)
+    pending = None
+    previous = None
+    for i, frame in enumerate(gif_range):
+        data = clip.raw_frame(frame)
+        if skip_duplicates and duplicate_filter.duplicate_of(frame, data) is not None:
+            continue
+        if motion_adaptive and motion_filter.is_static(data):
+            continue
+        if crop_changes:
+            data = view_bytes(data)
+            box = changed_area(data, previous, width, height)
+            previous = data
+            left, top, right, bottom = box
+            data = ''.join([data[(y*width+left)*3:(y*width+right+1)*3] 
+                            for y in range(top, bottom + 1)])
         else:
+            box = 0, 0, width - 1, height - 1
+            data = view_bytes(data) # the buffer is reused, so keep a copy
+        if pending:
+            write_frame(pending[1], pending[2], frame_delay(pending[0], i))
+        pending = i, box, data
+    write_frame(pending[1], pending[2], frame_delay(pending[0], len(gif_range)))
+    if builtin:
+        gif.close()
+        if notify_at_end:
             avsp.MsgBox(_('GIF created'), _('Info'))
+    else:
+        cmd.stdin.close()
+        if notify_at_end:
+            if cmd.wait():
+                avsp.MsgBox(_('GIF creation failed!') +'\n\n' + cmd.stdout.read(), 
+                            _('Error'))
+            else:
+                avsp.MsgBox(_('GIF created'), _('Info'))
 except:
-    try:
-        if cmd.poll() is None:
-            cmd.terminate()
-    except: pass
+    if builtin:
+        gif.close()
+        try:
+            os.remove(output_path)
+        except os.error: pass
+    else:
+        try:
+            if cmd.poll() is None:
+                cmd.terminate()
+        except: pass
     raise
+finally:
+    # 'convert' reads the palette after all the frames, so wait for it
+    if remap:
+        cmd.wait()
+        os.remove(palette_path)
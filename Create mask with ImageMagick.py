@@ -19,9 +19,38 @@ turns into:
   mask = ImageSource("C:\mask\path.png")
   Overlay(alt, mask=mask, mode="blend")
 
+The mask is rendered by the macro itself by default: the polygon is 
+filled with the even-odd rule and blurred with a gaussian (three box 
+blurs if numpy is not available), and the result saved as a grayscale 
+PNG.  ImageMagick can be selected as renderer instead.
+
+With 'animate between bookmarks' the vertices are selected on every 
+bookmark, in order (the same number of them each time), and a mask is 
+rendered for every frame from the first to the last bookmark, 
+interpolating the vertices linearly between the keyframes.  The masks are 
+saved as an image sequence named after the output path plus the frame 
+number, and 'Overlay' is applied only to that range:
+
+  mask=ImageSource("C:\mask\path-%03d.png", start=100, end=250, fps=23.976)
+  Trim(0,-100) ++ Overlay(Trim(100,250), alt.Trim(100,250), mask=mask, mode="blend") ++ Trim(251,0)
+
+The masks are rendered by several threads, but only the ImageMagick 
+renderer actually runs in parallel, with a 'convert' process per thread.  
+The built-in renderer is pure Python, so its threads take turns and it 
+uses a single core (processes can't be used from AvsPmod).
+
+Rendered masks are kept in a cache directory, named after a hash of the 
+vertices, video size, blur and renderer, and just copied to the output 
+path when the same mask is requested again, also for every frame of an 
+animated mask.  The cache is never cleaned up by the macro; its location 
+can be changed in the preferences section below.  If the directory can't 
+be created the masks are just not cached.
+
 
 Requirements:
-- 'convert' executable from ImageMagick <http://www.imagemagick.org>
+- 'convert' executable from ImageMagick <http://www.imagemagick.org>, 
+  only for the ImageMagick renderer
+- numpy (optional, faster blur with the built-in renderer)
 
 
 Windows installation:
@@ -41,13 +70,16 @@ If you only need ImageMagick for this macro then do the following:
 Just install ImageMagick on your system.
 
 
-Date: 2013-01-29
+Date: 2026-10-16
 Latest version:  https://github.com/vdcrim/avsp-macros
 
 Changelog:
 - AvxSynth compatibility
 - fix Python 2.6 compatibility
 - fix blur=0
+- add built-in renderer, ImageMagick is now optional
+- add animated masks interpolated between bookmarks
+- add mask cache
 
 
 Copyright (C) 2012, 2013  Diego Fernández Gosende <dfgosende@gmail.com>
@@ -67,6 +99,13 @@ with this program.  If not, see <http://www.gnu.org/licenses/gpl-2.0.html>.
 
 """
 
+# PREFERENCES
+
+# Reuse the masks already rendered with the same vertices, size, blur and 
+# renderer
+use_cache = True
+cache_dir = ur''  #  ur''  ->  'mask cache' in the AvsPmod tools directory
+
 
 # ------------------------------------------------------------------------------
 
@@ -77,6 +116,17 @@ import os
 import os.path
 import subprocess
 import re
+import math
+import hashlib
+import shutil
+import struct
+import zlib
+import threading
+import Queue
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def check_executable_path(executable, check_PATH_Windows=True, check_PATH_nix=False, 
                           error_message=None):
@@ -125,17 +175,155 @@ def check_executable_path(executable, check_PATH_Windows=True, check_PATH_nix=Fa
         error_message = _("{0} not found").format(executable)
     return prompt_path(executable, error_message)
 
-self = avsp.GetWindow()
+def rasterize_polygon(points, width, height):
+    '''Fill a polygon with the even-odd rule
+    
+    Return a list of 'height' bytearray rows and the (left, top, right, 
+    bottom) box of the filled pixels, or None if there isn't any.  The 
+    vertices are taken as the centre of the pixels they point to.  A pixel 
+    is filled if its centre is inside the polygon or it's crossed by an 
+    edge, so the selected vertices are included like with ImageMagick.
+    
+    '''
+    rows = [bytearray(width) for y in range(height)]
+    box = [width, height, -1, -1]
+    def fill(y, start, end):
+        '''Fill the pixels start to end - 1 of a row, clipped to the frame'''
+        start, end = max(0, start), min(width, end)
+        if 0 <= y < height and start < end:
+            rows[y][start:end] = '\xff' * (end - start)
+            box[:] = (min(box[0], start), min(box[1], y), 
+                      max(box[2], end - 1), max(box[3], y))
+    
+    # Interior: pixel centres at integer coordinates, half-open spans
+    sides = zip(points, points[-1:] + points[:-1])
+    edges = [(x0, y0, x1, y1) for (x0, y0), (x1, y1) in sides if y0 != y1]
+    ys = [y for x, y in points]
+    for y in range(max(0, min(ys)), min(height, max(ys) + 1)):
+        crossings = sorted([x0 + float(y - y0) * (x1 - x0) / (y1 - y0) 
+                            for x0, y0, x1, y1 in edges 
+                            if (y0 <= y < y1) or (y1 <= y < y0)])
+        for i in range(0, len(crossings) - 1, 2):
+            fill(y, int(math.ceil(crossings[i])), int(math.ceil(crossings[i+1])))
+    
+    # Outline: on every row, the pixels the edge goes through
+    for (x0, y0), (x1, y1) in sides:
+        if y0 == y1:
+            fill(y0, min(x0, x1), max(x0, x1) + 1)
+            continue
+        if y0 > y1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        slope = float(x1 - x0) / (y1 - y0)
+        for y in range(max(0, y0), min(height, y1 + 1)):
+            xa = x0 + (max(y0, y - 0.5) - y0) * slope
+            xb = x0 + (min(y1, y + 0.5) - y0) * slope
+            fill(y, int(round(min(xa, xb))), int(round(max(xa, xb))) + 1)
+    if box[2] < 0:
+        return rows, None
+    return rows, box
+
+def box_radii(sigma, passes=3):
+    '''Radii of the box blurs that approximate a gaussian blur of sigma'''
+    ideal = math.sqrt(12.0 * sigma * sigma / passes + 1)
+    lower = int(ideal)
+    if not lower % 2:
+        lower -= 1
+    upper = lower + 2
+    count = int(round((12.0 * sigma * sigma - passes * lower * lower - 
+                       4 * passes * lower - 3 * passes) / (-4 * lower - 4)))
+    return [(lower if i < count else upper) // 2 for i in range(passes)]
+
+def box_blur_rows(rows, radius):
+    '''Box blur every row, replicating the values on the edges
+    
+    The sums aren't divided by the size of the box.
+    
+    '''
+    if not radius:
+        return rows
+    blurred_rows = []
+    for row in rows:
+        padded = [row[0]] * radius + list(row) + [row[-1]] * radius
+        total = sum(padded[:2*radius])
+        blurred = []
+        append = blurred.append
+        for i, value in enumerate(padded[2*radius:]):
+            total += value
+            append(total)
+            total -= padded[i]
+        blurred_rows.append(blurred)
+    return blurred_rows
+
+def blur_mask(rows, box, sigma):
+    '''Gaussian blur the area of a mask around box, in place
+    
+    The area is extended by the reach of the blur, so everything outside 
+    it is still black afterwards.  numpy is used if available, otherwise 
+    three box blurs are applied on each direction.
+    
+    '''
+    width, height = len(rows[0]), len(rows)
+    if numpy is not None:
+        radius = int(math.ceil(3 * sigma))
+    else:
+        radii = box_radii(sigma)
+        radius = sum(radii)
+    left, top = max(0, box[0] - radius), max(0, box[1] - radius)
+    right, bottom = min(width - 1, box[2] + radius), min(height - 1, box[3] + radius)
+    region = [rows[y][left:right+1] for y in range(top, bottom + 1)]
+    if numpy is not None:
+        data = numpy.frombuffer(''.join([str(row) for row in region]), numpy.uint8)
+        data = data.reshape(len(region), len(region[0])).astype(numpy.float32)
+        offsets = numpy.arange(-radius, radius + 1)
+        kernel = numpy.exp(-offsets * offsets / (2.0 * sigma * sigma))
+        kernel /= kernel.sum()
+        for axis in (0, 1):
+            size = data.shape[axis]
+            pad_width = [(0, 0), (0, 0)]
+            pad_width[axis] = (radius, radius)
+            padded = numpy.pad(data, pad_width, 'edge')
+            data = numpy.zeros_like(data)
+            for i, weight in enumerate(kernel):
+                if axis:
+                    data += weight * padded[:, i:i+size]
+                else:
+                    data += weight * padded[i:i+size]
+        data = numpy.round(data).clip(0, 255).astype(numpy.uint8)
+        region = [bytearray(row.tostring()) for row in data]
+    else:
+        for radius in radii:
+            region = box_blur_rows(region, radius)
+        region = zip(*region)
+        for radius in radii:
+            region = box_blur_rows(region, radius)
+        region = zip(*region)
+        scale = 1
+        for radius in radii:
+            scale *= (2 * radius + 1) ** 2
+        region = [bytearray([(value + scale // 2) // scale for value in row]) 
+                  for row in region]
+    for y, row in enumerate(region):
+        rows[top + y][left:right+1] = row
+
+def png_chunk(tag, data):
+    '''Return a PNG chunk'''
+    crc = zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff
+    return ''.join((struct.pack('>I', len(data)), tag, data, struct.pack('>I', crc)))
+
+def encode_png(rows):
+    '''Encode a list of bytearray rows as an 8-bit grayscale PNG'''
+    # Filter type 0 (none) for every row
+    idat = zlib.compress(''.join(['\x00' + str(row) for row in rows]))
+    ihdr = struct.pack('>IIBBBBB', len(rows[0]), len(rows), 8, 0, 0, 0, 0)
+    return ''.join(('\x89PNG\r\n\x1a\n', png_chunk('IHDR', ihdr), 
+                    png_chunk('IDAT', idat), png_chunk('IEND', '')))
 
-# Check convert path
-convert_path = avsp.Options.get('convert_path', '')
-if not os.path.isfile(convert_path):
-    if not check_executable_path('convert', False, True,
-                                 _("'convert' from ImageMagick not found")):
-        return
-    convert_path = avsp.Options['convert_path']
+self = avsp.GetWindow()
 
 # Get options
+backend = avsp.Options.get('backend', _('Built-in'))
+animate = avsp.Options.get('animate', False)
+workers = avsp.Options.get('workers', 4)
 mask_path = avsp.GetScriptFilename()
 if not mask_path:
     if self.version > '2.3.1':
@@ -151,19 +339,51 @@ while True:
     options = avsp.GetTextEntry(
             title=_('Create mask - select the vertices after pressing OK'),
             message=[_('Output path'), 
-                     [_('Blur'), _('Apply mask to script'),_('Refresh preview')]
+                     [_('Blur'), _('Apply mask to script'),_('Refresh preview')], 
+                     _('Renderer'), 
+                     [_('Animate between bookmarks'), _('Threads')]
                     ], 
-            default=[mask_path, [(0, 0, 65355, 1), True, True]], 
-            types=['file_save', ['spin', 'check', 'check']], 
+            default=[mask_path, [(0, 0, 65355, 1), True, True], 
+                     [_('Built-in'), 'ImageMagick', backend], 
+                     [animate, (workers, 1, 64)]], 
+            types=['file_save', ['spin', 'check', 'check'], 'list_read_only', 
+                   ['check', 'spin']], 
             width=350)
     if not options: return
     if options[0]: break
     if not avsp.MsgBox(_('An output path is needed'), _('Error'), True):
         return
-mask_path, blur, apply_mask, refresh_preview = options
+mask_path, blur, apply_mask, refresh_preview, backend, animate, workers = options
 if not mask_path.endswith('.png'):
     mask_path = mask_path + '.png'
-blur = ('-blur', '0x{0}'.format(blur)) if blur else None
+avsp.Options['backend'] = backend
+avsp.Options['animate'] = animate
+avsp.Options['workers'] = workers
+if animate:
+    keyframes = sorted(set(avsp.GetBookmarkList()))
+    if len(keyframes) < 2:
+        avsp.MsgBox(_('At least two bookmarks are needed'), _('Error'))
+        return
+
+# Create the cache directory
+if use_cache:
+    if not cache_dir:
+        cache_dir = os.path.join(self.toolsfolder, 'mask cache')
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # e.g. read-only tools directory, just don't cache
+            use_cache = False
+
+# Check convert path
+if backend == 'ImageMagick':
+    convert_path = avsp.Options.get('convert_path', '')
+    if not os.path.isfile(convert_path):
+        if not check_executable_path('convert', False, True,
+                                     _("'convert' from ImageMagick not found")):
+            return
+        convert_path = avsp.Options['convert_path']
 
 # Search for the overlay clip
 avs_text = avsp.GetText()
@@ -181,21 +401,30 @@ if avs_text.endswith('\n'):
 else:
     avsp.InsertText('\nlast')
 
-# Get the mask vertices
+# Get the mask vertices, on every bookmark if animating
 version = self.version
 if version < '2.3.0':
     avsp.MsgBox(_('AvsPmod 2.3.0+ needed'), _('Error'))
     return
-elif version == '2.3.0':
-    points = avsp.GetPixelInfo(color=None, wait=True)
-else:
-    points = avsp.GetPixelInfo(color=None, wait=True, lines=True)
-if not points:
-    avsp.MsgBox(_('Not points selected - mask creation aborted'), _('Info'))
-    return
-if len(points) < 3:
-    avsp.MsgBox(_('At least three points are needed'), _('Error'))
-    return
+keyframe_points = []
+for keyframe in (keyframes if animate else [None]):
+    if keyframe is not None:
+        avsp.ShowVideoFrame(keyframe)
+    if version == '2.3.0':
+        points = avsp.GetPixelInfo(color=None, wait=True)
+    else:
+        points = avsp.GetPixelInfo(color=None, wait=True, lines=True)
+    if not points:
+        avsp.MsgBox(_('Not points selected - mask creation aborted'), _('Info'))
+        return
+    if len(points) < 3:
+        avsp.MsgBox(_('At least three points are needed'), _('Error'))
+        return
+    if keyframe_points and len(points) != len(keyframe_points[0]):
+        avsp.MsgBox(_('Every keyframe must have the same number of vertices'), 
+                    _('Error'))
+        return
+    keyframe_points.append(points)
 
 width, height = avsp.GetVideoWidth(), avsp.GetVideoHeight()
 
@@ -204,45 +433,161 @@ avs = self.currentScript
 avs.SetSelection(avs.PositionFromLine(avs.GetLineCount() - 1), -1)
 avs.Clear()
 
-# Create the mask with ImageMagick
-
-# - Issue 1: Python 2.x doesn't support unicode args in subprocess.Popen()
-#   http://bugs.python.org/issue1759845
-#   Encoding to system's locale encoding
-# - Issue 2: handle inheritance issues if any of stdin, stdout or stderr 
-#   but not all three are specified and the process is started under some 
-#   circumstances.
-#   http://www.py2exe.org/index.cgi/Py2ExeSubprocessInteractions
-#   http://bugs.python.org/issue3905
-#   http://bugs.python.org/issue1124861
-cmd = [convert_path, '-type', 'Grayscale', '-depth', '8', '-size', 
-       '{0}x{1}'.format(width, height), 'xc:black', '-fill', 'white', '-draw', 
-       'polygon {0}'.format(' '.join(['{0},{1}'.format(x, y) for x, y in points]))]
-if blur: cmd.extend(blur)
-cmd.append(mask_path)
-code = sys.getfilesystemencoding()
-cmd = [arg.encode(code) for arg in cmd]
-if os.name == 'nt':
-    info = subprocess.STARTUPINFO()
+# Create the mask, with the built-in renderer or ImageMagick
+def render_mask(points, path):
+    '''Render the mask of a polygon and save it.  Return an error or None'''
+    if backend == 'ImageMagick':
+        # - Issue 1: Python 2.x doesn't support unicode args in subprocess.Popen()
+        #   http://bugs.python.org/issue1759845
+        #   Encoding to system's locale encoding
+        # - Issue 2: handle inheritance issues if any of stdin, stdout or stderr 
+        #   but not all three are specified and the process is started under some 
+        #   circumstances.
+        #   http://www.py2exe.org/index.cgi/Py2ExeSubprocessInteractions
+        #   http://bugs.python.org/issue3905
+        #   http://bugs.python.org/issue1124861
+        cmd = [convert_path, '-type', 'Grayscale', '-depth', '8', '-size', 
+               '{0}x{1}'.format(width, height), 'xc:black', '-fill', 'white', '-draw', 
+               'polygon {0}'.format(' '.join(['{0},{1}'.format(x, y) for x, y in points]))]
+        if blur: cmd.extend(('-blur', '0x{0}'.format(blur)))
+        cmd.append(path)
+        code = sys.getfilesystemencoding()
+        cmd = [arg.encode(code) for arg in cmd]
+        if os.name == 'nt':
+            info = subprocess.STARTUPINFO()
+            try:
+                info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                info.wShowWindow = subprocess.SW_HIDE
+            except AttributeError:
+                import _subprocess
+                info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
+                info.wShowWindow = _subprocess.SW_HIDE
+            cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                   stderr=subprocess.STDOUT, startupinfo=info)
+        else:
+            cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                   stderr=subprocess.STDOUT)
+        stdout = cmd.communicate()[0]
+        return stdout if cmd.returncode else None
+    mask, box = rasterize_polygon(points, width, height)
+    if blur and box is not None:
+        blur_mask(mask, box, blur)
+    try:
+        with open(path, 'wb') as f:
+            f.write(encode_png(mask))
+    except IOError, err:
+        return str(err)
+
+def mask_key(points):
+    '''Return the cache key of a mask'''
+    if backend == 'ImageMagick':
+        renderer = 'ImageMagick'
+    else:
+        renderer = 'numpy' if numpy is not None else 'box blur'
+    key = u'\n'.join((unicode(points), unicode(width), unicode(height), 
+                      unicode(blur), renderer))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def cached_render_mask(points, path):
+    '''Copy the mask from the cache, rendering it there first if needed'''
+    if not use_cache:
+        return render_mask(points, path)
+    cache_path = os.path.join(cache_dir, mask_key(points) + '.png')
+    if not os.path.isfile(cache_path):
+        # Threads may be rendering the same mask, so use a name of their own
+        temp_path = u'{0}.{1}.png'.format(cache_path[:-4], threading.current_thread().ident)
+        error = render_mask(points, temp_path)
+        if error is not None:
+            return error
+        try:
+            os.rename(temp_path, cache_path)
+        except OSError, err:
+            # Another thread may have saved it first
+            if not os.path.isfile(cache_path):
+                return str(err)
+            os.remove(temp_path)
     try:
-        info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        info.wShowWindow = subprocess.SW_HIDE
-    except AttributeError:
-        import _subprocess
-        info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
-        info.wShowWindow = _subprocess.SW_HIDE
-    cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                           stderr=subprocess.STDOUT, startupinfo=info)
+        shutil.copyfile(cache_path, path)
+    except (IOError, OSError), err:
+        return str(err)
+
+def render_masks(tasks, errors):
+    '''Render the (points, path) masks in the queue until None is found'''
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        if not errors:
+            error = cached_render_mask(*task)
+            if error is not None:
+                errors.append(error)
+
+def interpolate(start_points, end_points, weight):
+    '''Linear interpolation of the vertices of two keyframes'''
+    return [(int(round(x0 + (x1 - x0) * weight)), int(round(y0 + (y1 - y0) * weight))) 
+            for (x0, y0), (x1, y1) in zip(start_points, end_points)]
+
+if not animate:
+    error = cached_render_mask(keyframe_points[0], mask_path)
 else:
-    cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                           stderr=subprocess.STDOUT)
+    # One mask per frame between the first and last bookmark, named with 
+    # the frame number.  The frames are rendered by 'workers' threads.  Only 
+    # with ImageMagick they run in parallel, as so many 'convert' processes; 
+    # the built-in renderer holds the GIL
+    start, end = keyframes[0], keyframes[-1]
+    digits = len(str(end))
+    base = mask_path[:-4]
+    tasks = Queue.Queue(2 * workers)
+    errors = []
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=render_masks, args=(tasks, errors))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    progress = avsp.ProgressBox(end - start + 1, _('Rendering masks...'), 
+                                _('Create mask'))
+    cancelled = False
+    for i, keyframe in enumerate(keyframes[:-1]):
+        next_keyframe = keyframes[i+1]
+        for frame in range(keyframe, next_keyframe + (i == len(keyframes) - 2)):
+            if errors:
+                break
+            if not avsp.SafeCall(progress.Update, frame - start)[0]:
+                cancelled = True
+                break
+            points = interpolate(keyframe_points[i], keyframe_points[i+1], 
+                float(frame - keyframe) / (next_keyframe - keyframe))
+            tasks.put((points, u'{0}-{1:0{2}}.png'.format(base, frame, digits)))
+        if errors or cancelled:
+            break
+    for thread in threads:
+        tasks.put(None)
+    for thread in threads:
+        thread.join()
+    avsp.SafeCall(progress.Destroy)
+    if cancelled:
+        return
+    error = errors[0] if errors else None
 
-# Wait for the mask to be created and insert it in the script
-stdout = cmd.communicate()[0]
-if cmd.returncode:
-    avsp.MsgBox(_('Mask creation failed:\n' + stdout), _('Error'))
+# Insert the mask in the script
+if error is not None:
+    avsp.MsgBox(_('Mask creation failed:\n' + error), _('Error'))
 elif apply_mask:
-    avsp.InsertText(u'mask={0}\nOverlay({1}, mask=mask, mode="blend")\n'
-                    .format(avsp.GetSourceString(mask_path), clip))
+    if not animate:
+        avsp.InsertText(u'mask={0}\nOverlay({1}, mask=mask, mode="blend")\n'
+                        .format(avsp.GetSourceString(mask_path), clip))
+    else:
+        # Overlay only the range of the masks, keeping the rest of the clip
+        source = u'mask=ImageSource("{0}-%0{1}d.png", start={2}, end={3}, fps={4})\n'.format(
+                 base, digits, start, end, avsp.GetVideoFramerate())
+        parts = [u'Overlay(Trim({0},{1}), {2}.Trim({0},{1}), mask=mask, mode="blend")'
+                 .format(start, end, clip)]
+        if start:
+            # A frame count, as Trim(0,0) would be the whole clip
+            parts.insert(0, u'Trim(0,-{0})'.format(start))
+        if end < avsp.GetVideoFramecount() - 1:
+            parts.append(u'Trim({0},0)'.format(end + 1))
+        avsp.InsertText(source + u' ++ '.join(parts) + u'\n')
     if refresh_preview:
-        avsp.UpdateVideo()
\ No newline at end of file
+        avsp.UpdateVideo()
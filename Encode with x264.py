@@ -27,6 +27,7 @@ Features:
 - Not display any window while encoding and notify at the end.
 - Save the x264 logs and a copy of the Avisynth script.
 - Close the current tab and/or preview tabs on its right.
+- Chunked parallel encoding.
 
 Anamorphic encoding:
 In addition to select or introduce its value in the prompt, the video DAR 
@@ -52,10 +53,20 @@ like these:
 The parameters read override the prompt defaults, or are added to "additional 
 parameters" if they don't have a specific field.
 
+Chunked encoding:
+The frame range can be split in chunks, at the bookmarks, every N frames, 
+in a number of intervals or at the keyframes of the QP file (at least N 
+frames apart), and the chunks encoded at the same time by several hidden 
+avs4x264mod processes.  Every chunk is a temporary script next to the avs 
+that imports it and trims it.  The zones and the QP file are adjusted for 
+every chunk.  When all of them finish the raw streams are joined in order, 
+so the output must be a raw bytestream (.264).  Only the CRF mode is 
+supported, and not a timecodes file.  The logs are not saved in this mode.
+
 See the "PREFERENCES" section below to check and customize the other features.
 
 
-Date: 2013-01-29
+Date: 2026-10-16
 Latest version:     https://github.com/vdcrim/avsp-macros
 Doom9 Forum thread: http://forum.doom9.org/showthread.php?t=163440
 
@@ -79,6 +90,7 @@ Changelog:
 - add option to close the current tab and/or preview tabs on its right
 - fix Python 2.6 compatibility
 - add support for Dither_out (Dither v1.22.0+)
+- add chunked parallel encoding
 
 
 Copyright (C) 2011-2013  Diego Fernández Gosende <dfgosende@gmail.com>
@@ -158,7 +170,8 @@ avs_log_dir = ur""  #  ur""  ->  "AvsPmod\tools\x264 logs" directory
 import os
 import os.path
 import sys
-from shutil import copy2
+from shutil import copy2, copyfileobj
+import subprocess
 from subprocess import Popen
 import time
 import re
@@ -230,6 +243,39 @@ def best_rationals(afloat):
         if abs(afloat - float(num)/den) <= 0.001:
             return num, den
 
+def float_range_list(start, stop, step):
+    '''float range (list) with stop included'''
+    ret = []
+    while start < stop:
+        ret.append(int(round(start)))
+        start += step
+    ret.append(stop)
+    return ret
+
+def read_keyframes(path):
+    '''Return the sorted IDR frames (types I and K) of a QP file'''
+    keyframes = set()
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 1 and fields[1] in ('I', 'K'):
+                try:
+                    keyframes.add(int(fields[0]))
+                except ValueError:
+                    pass
+    return sorted(keyframes)
+
+def chunk_zones(zones, start, end):
+    '''Cut the zones to the frames start-end of a chunk and shift them'''
+    chunk = []
+    for zone in zones.split('/'):
+        zone_start, zone_end, params = zone.split(',', 2)
+        zone_start, zone_end = max(int(zone_start), start), min(int(zone_end), end)
+        if zone_start <= zone_end:
+            chunk.append('{0},{1},{2}'.format(zone_start - start, zone_end - start, 
+                                              params))
+    return '/'.join(chunk)
+
 # Check paths and get avs path
 avs4x264mod_path = avsp.Options.get('avs4x264mod_path', '')
 if not os.path.isfile(avs4x264mod_path):
@@ -270,6 +316,7 @@ rgb_flags = avsp.Options.get('RGB / YCbCr flags', 'HD')
 blu_ray = avsp.Options.get('Blu-ray compatible', False)
 open_gop = avsp.Options.get('Open-GOP', False)
 add_params = avsp.Options.get('Additional parameters', '')
+chunked = avsp.Options.get('Chunked encoding', False)
 tc_file = ur""  #    ur"" -> avs_name.tc_suffix, if exists
 qp_file = ur""  #    ur"" -> avs_name.qp_suffix, if exists
 output = ur""  #    ur"" -> avs_name.avs.ext
@@ -417,7 +464,8 @@ message = [[_('Mode'), _('CRF / Bitrate'), _('Preset'), _('Tune')], '',
            [_('Input range'), _('Output range'), _('Output colorspace')], 
            [_('RGB / YCbCr flags'), _('Blu-Ray compatible'), _('Open-GOP')], 
            _('Timecodes file'), _('QP file'), 
-           _('Additional parameters'), _('Save current settings as default'), '', 
+           _('Additional parameters'), 
+           [_('Save current settings as default'), _('Chunked parallel encoding')], '', 
            _('Output')
           ]
 default = [[('CRF', '2-pass ABR', mode.capitalize()), 
@@ -441,13 +489,13 @@ default = [[('CRF', '2-pass ABR', mode.capitalize()),
             blu_ray, open_gop
            ], 
            (tc_file, tc_filter), (qp_file, qp_filter), 
-           add_params, False, '', (output,output_filter)
+           add_params, [False, chunked], '', (output,output_filter)
           ]        
 types = [['list_read_only', 'spin', 'list_read_only', 'list_writable'], 'sep', 
          ['list_writable', 'list_read_only', 'list_read_only'],
          ['list_read_only', 'list_read_only', 'list_read_only'], 
          ['list_writable', 'check', 'check'], 
-         'file_open', 'file_open', '', 'check', 'sep', 'file_save'
+         'file_open', 'file_open', '', ['check', 'check'], 'sep', 'file_save'
         ]
 options = avsp.GetTextEntry(title=_('Encode with x264 - x264 parameters'),
                        message=message, default=default, types=types, width=320)
@@ -510,6 +558,7 @@ open_gop = ' --open-gop' if options[12] else ''
 tcfile = ' --tcfile-in "' + options[13] + '"' if options[13] else ''
 qpfile = ' --qpfile "' + options[14] + '"' if options[14] else ''
 add_params = options[15]
+chunked = options[17]
 output = options[-1]
 
 # Save options
@@ -529,6 +578,7 @@ if options[16]:
     avsp.Options['Blu-ray compatible'] = options[11]
     avsp.Options['Open-GOP'] = options[12]
     avsp.Options['Additional parameters'] = options[15]
+    avsp.Options['Chunked encoding'] = chunked
 
 # Check input depth parameter
 if check_depth:
@@ -540,6 +590,75 @@ if check_depth:
                     .format(out_16_str1), _('Error'))
         return
 
+# Split the frame range for chunked encoding.  The frame count and 
+# bookmarks are read now, before closing any tab
+if chunked:
+    if mode != 'crf':
+        avsp.MsgBox(_('Chunked encoding is only available in CRF mode'), _('Error'))
+        return
+    if tcfile:
+        avsp.MsgBox(_('Timecodes files are not supported in chunked encoding'), 
+                    _('Error'))
+        return
+    if not output.lower().endswith('.264'):
+        avsp.MsgBox(_('Chunked encoding outputs a raw bytestream (.264)'), _('Error'))
+        return
+    split_list = (_('using the current bookmarks'), _('specifying a frame step'), 
+                  _('specifying a number of intervals'), 
+                  _('QP file keyframes, at least a frame step apart'))
+    split = avsp.Options.get('Chunk split', split_list[1])
+    frame_step = avsp.Options.get('Chunk frame step', 5000)
+    intervals = avsp.Options.get('Chunk intervals', 8)
+    workers = avsp.Options.get('Chunk workers', 4)
+    chunk_options = avsp.GetTextEntry(title=_('Encode with x264 - chunked encoding'), 
+        message=[_('Split by...'), 
+                 [_('Frame step'), _('Number of intervals'), _('Parallel encodings')]], 
+        default=[split_list + (split,), 
+                 [(frame_step, 1, None, 0, max(1, 10 ** (len(str(frame_step)) - 2))), 
+                  (intervals, 1), (workers, 1, 64)]], 
+        types=['list_read_only', ['spin', 'spin', 'spin']], 
+        width=320)
+    if not chunk_options:
+        return
+    split, frame_step, intervals, workers = chunk_options
+    avsp.Options['Chunk split'] = split
+    avsp.Options['Chunk frame step'] = frame_step
+    avsp.Options['Chunk intervals'] = intervals
+    avsp.Options['Chunk workers'] = workers
+    frame_count = avsp.GetVideoFramecount()
+    if split == _('using the current bookmarks'):
+        frame_list = sorted(set([bm for bm in avsp.GetBookmarkList() 
+                                 if 0 < bm < frame_count] + [0, frame_count]))
+    elif split == _('specifying a frame step'):
+        frame_list = float_range_list(0, frame_count, frame_step)
+    elif split == _('specifying a number of intervals'):
+        frame_list = float_range_list(0, frame_count, frame_count / float(intervals))
+    else:
+        if not options[14]:
+            avsp.MsgBox(_('A QP file is needed'), _('Error'))
+            return
+        frame_list = [0]
+        for keyframe in read_keyframes(options[14]):
+            if keyframe - frame_list[-1] >= frame_step and keyframe < frame_count:
+                frame_list.append(keyframe)
+        frame_list.append(frame_count)
+    frame_list = sorted(set(frame_list))
+    chunks = [(frame, frame_list[i+1] - 1) for i, frame in enumerate(frame_list[:-1])]
+    
+    # The zones and the QP file are applied to every chunk separately
+    zones = ''
+    re_match = re.search(r'\s*--zones\s+(\S+)', add_params)
+    if re_match:
+        zones = re_match.group(1).strip('"')
+        add_params = add_params[:re_match.start()] + add_params[re_match.end():]
+    qp_lines = []
+    if options[14]:
+        with open(options[14]) as f:
+            for line in f:
+                fields = line.split(None, 1)
+                if len(fields) > 1 and fields[0].isdigit():
+                    qp_lines.append((int(fields[0]), fields[1]))
+
 # Close tabs 
 if close_temp_tabs:
     avsp.HideVideoWindow()
@@ -573,27 +692,128 @@ if save_avs_copy:
     copy2(avs, os.path.join(avs_log_dir.encode(code), date_time + os.path.basename(avs)))
 
 # Start the encoding process
+base_args = (' "' + avs4x264mod_path + '"' + 
+             ' --x264-binary "' + x264_path + '"' + 
+             ' --preset ' + preset + 
+             tune + 
+             crf + 
+             ' --demuxer raw' + 
+             ' --input-depth ' + input_depth + 
+             ' --output-csp ' + output_csp + 
+             sar + 
+             scan_type + 
+             input_range + 
+             output_range + 
+             colorprim + 
+             transfer + 
+             colormatrix + 
+             blu_ray +  
+             open_gop)
+
+# Chunked encoding: every chunk is a script that imports the main one and 
+# trims it, encoded by its own hidden avs4x264mod process, up to 'workers' 
+# of them at the same time.  The raw streams are joined in order at the end
+if chunked:
+    if os.name == 'nt':
+        info = subprocess.STARTUPINFO()
+        try:
+            info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            info.wShowWindow = subprocess.SW_HIDE
+        except AttributeError:
+            import _subprocess
+            info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
+            info.wShowWindow = _subprocess.SW_HIDE
+    else:
+        info = None
+    
+    def chunk_path(index, suffix):
+        '''Path of a temporary file of a chunk'''
+        return u'{0}.chunk{1:0{2}}{3}'.format(avs_no_ext.decode(code), index, 
+                                              len(str(len(chunks))), suffix)
+    
+    def start_chunk(index):
+        '''Write the files of a chunk and start its encoding'''
+        start, end = chunks[index]
+        with open(chunk_path(index, '.avs'), 'w') as f:
+            f.write('Import("{0}")\nTrim({1},{2})\n'.format(avs, start, 
+                                                            start - end - 1))
+        chunk_args = base_args
+        zones_str = chunk_zones(zones, start, end) if zones else ''
+        if zones_str:
+            chunk_args += ' --zones ' + zones_str
+        if qp_lines:
+            with open(chunk_path(index, '.qp'), 'w') as f:
+                for frame, rest in qp_lines:
+                    if start <= frame <= end:
+                        f.write('{0} {1}'.format(frame - start, rest))
+            chunk_args += ' --qpfile "' + chunk_path(index, '.qp') + '"'
+        chunk_args += (' ' + add_params + 
+                       ' --output "' + chunk_path(index, '.264') + '"' + 
+                       ' "' + chunk_path(index, '.avs') + '"')
+        log = open(chunk_path(index, '.log'), 'w')
+        try:
+            return Popen(chunk_args.encode(code).strip(), stdin=subprocess.PIPE, 
+                         stdout=log, stderr=subprocess.STDOUT, startupinfo=info)
+        finally:
+            log.close()
+    
+    progress = avsp.ProgressBox(len(chunks), _('Encoding chunks...'), 
+                                _('Encode with x264'))
+    running = {}
+    next_chunk = finished = 0
+    error = None
+    done = False
+    try:
+        while finished < len(chunks):
+            while next_chunk < len(chunks) and len(running) < workers:
+                running[next_chunk] = start_chunk(next_chunk)
+                next_chunk += 1
+            for index, process in running.items():
+                if process.poll() is not None:
+                    del running[index]
+                    if process.returncode:
+                        with open(chunk_path(index, '.log')) as f:
+                            error = f.read()[-2000:]
+                        break
+                    finished += 1
+            if error is not None:
+                break
+            if not avsp.SafeCall(progress.Update, finished, 
+                    _('Encoding chunks... {0}/{1}').format(finished, len(chunks)))[0]:
+                break
+            time.sleep(0.2)
+        else:
+            with open(output, 'wb') as f:
+                for index in range(len(chunks)):
+                    with open(chunk_path(index, '.264'), 'rb') as chunk:
+                        copyfileobj(chunk, f)
+            done = True
+    finally:
+        for process in running.values():
+            try:
+                if process.poll() is None:
+                    process.terminate()
+                    process.wait()
+            except: pass
+        avsp.SafeCall(progress.Destroy)
+        for index in range(next_chunk):
+            for suffix in ('.avs', '.qp', '.264', '.log'):
+                try:
+                    os.remove(chunk_path(index, suffix))
+                except os.error: pass
+    if done:
+        avsp.MsgBox(_('Encoding of "{0}" finished').format(os.path.basename(output)), 
+                    _('Info'))
+    elif error is not None:
+        avsp.MsgBox(_('Encoding failed:\n\n') + error.decode(code, 'replace'), 
+                    _('Error'))
+    return
+
 start = 'start ' + start_params + (' /b' if hide_cmd else '')
 cmd = ' cmd ' + ('/k "' if keep_cmd_open and not hide_cmd else '/c "')
 end_notice =  ' && start echo {0}"'.format(_('Encoding of "{0}" finished').format(
                         os.path.basename(output))).encode(code) if hide_cmd else '"'
-args = (' "' + avs4x264mod_path + '"' + 
-        ' --x264-binary "' + x264_path + '"' + 
-        ' --preset ' + preset + 
-        tune + 
-        crf + 
-        ' --demuxer raw' + 
-        ' --input-depth ' + input_depth + 
-        ' --output-csp ' + output_csp + 
-        sar + 
-        scan_type + 
-        input_range + 
-        output_range + 
-        colorprim + 
-        transfer + 
-        colormatrix + 
-        blu_ray +  
-        open_gop +
+args = (base_args + 
         tcfile + 
         qpfile + 
         ' ' + add_params + 
@@ -22,12 +22,19 @@ becomes:
 where (a, b) is the center of the mask, selected by clicking on the video 
 preview.
 
+If 'preview' is checked the shape is drawn over the current frame of the 
+video preview in a dialog before inserting anything, so the radii and the 
+center (clicking on the image) can be adjusted without evaluating the 
+script again.  The drawing is only an approximation of the GraMaMa mask; 
+'Line' is shown as a horizontal band.
 
-Date: 2012-09-11
+
+Date: 2026-10-16
 Latest version:  https://github.com/vdcrim/avsp-macros
 
 Changelog:
 - fix Python 2.6 compatibility
+- add preview dialog
 
 
 Copyright (C) 2012  Diego Fernández Gosende <dfgosende@gmail.com>
@@ -62,19 +69,95 @@ clip = 'b'
 # Refresh the video preview at the end
 refresh_preview = True
 
+# Adjust the mask over the current frame before inserting it
+preview = True
+
 
 # ------------------------------------------------------------------------------
 
 
 import re
+import wx
+
+class PreviewDialog(wx.Dialog):
+    '''Draw a shape over a bitmap, letting the user change its size and center'''
+    
+    def __init__(self, parent, bitmap, mode, center, rad, rad2):
+        wx.Dialog.__init__(self, parent, wx.ID_ANY, _('GraMaMa mask'))
+        self.mode, self.center = mode, center
+        width, height = bitmap.GetWidth(), bitmap.GetHeight()
+        display_width, display_height = wx.GetDisplaySize()
+        self.scale = min(1.0, 0.75 * display_width / width, 
+                         0.6 * display_height / height)
+        image = bitmap.ConvertToImage().Scale(int(width * self.scale), 
+            int(height * self.scale), wx.IMAGE_QUALITY_HIGH)
+        self.bitmap = wx.BitmapFromImage(image)
+        self.panel = wx.Panel(self, wx.ID_ANY, size=self.bitmap.GetSize())
+        self.panel.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.panel.Bind(wx.EVT_LEFT_DOWN, self.OnClick)
+        self.rad = wx.Slider(self, wx.ID_ANY, rad, 1, max(width, height, rad), 
+                             style=wx.SL_HORIZONTAL|wx.SL_LABELS)
+        self.rad2 = wx.Slider(self, wx.ID_ANY, rad2, 1, max(width, height, rad2), 
+                              style=wx.SL_HORIZONTAL|wx.SL_LABELS)
+        self.rad2.Enable(mode in (5, 6))
+        for slider in (self.rad, self.rad2):
+            slider.Bind(wx.EVT_SLIDER, lambda event: self.panel.Refresh())
+        grid = wx.FlexGridSizer(cols=2, hgap=5, vgap=5)
+        grid.AddGrowableCol(1)
+        for label, slider in ((_('Horizontal radius'), self.rad), 
+                              (_('Vertical radius'), self.rad2)):
+            grid.Add(wx.StaticText(self, wx.ID_ANY, label), 0, wx.ALIGN_CENTER_VERTICAL)
+            grid.Add(slider, 0, wx.EXPAND)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.panel, 0, wx.ALL, 5)
+        sizer.Add(wx.StaticText(self, wx.ID_ANY, 
+                  _('Click on the image to move the center')), 0, wx.LEFT|wx.RIGHT, 5)
+        sizer.Add(grid, 0, wx.EXPAND|wx.ALL, 5)
+        sizer.Add(self.CreateStdDialogButtonSizer(wx.OK|wx.CANCEL), 0, 
+                  wx.EXPAND|wx.ALL, 5)
+        self.SetSizerAndFit(sizer)
+        self.Center()
+    
+    def OnClick(self, event):
+        x, y = event.GetPosition()
+        self.center = int(x / self.scale), int(y / self.scale)
+        self.panel.Refresh()
+    
+    def OnPaint(self, event):
+        dc = wx.PaintDC(self.panel)
+        dc.DrawBitmap(self.bitmap, 0, 0)
+        dc = wx.GCDC(dc)
+        dc.SetPen(wx.Pen(wx.Colour(255, 0, 0)))
+        dc.SetBrush(wx.Brush(wx.Colour(255, 0, 0, 96)))
+        x, y = [int(round(value * self.scale)) for value in self.center]
+        rx = int(round(self.rad.GetValue() * self.scale))
+        ry = int(round(self.rad2.GetValue() * self.scale))
+        if self.mode == 1: # circle
+            dc.DrawEllipse(x - rx, y - rx, 2 * rx, 2 * rx)
+        elif self.mode == 2: # square
+            dc.DrawRectangle(x - rx, y - rx, 2 * rx, 2 * rx)
+        elif self.mode == 3: # diamond
+            dc.DrawPolygon([(x, y - rx), (x + rx, y), (x, y + rx), (x - rx, y)])
+        elif self.mode == 4: # line
+            dc.DrawRectangle(0, y - rx, self.bitmap.GetWidth(), 2 * rx)
+        elif self.mode == 5: # ellipse
+            dc.DrawEllipse(x - rx, y - ry, 2 * rx, 2 * ry)
+        else: # rectangle
+            dc.DrawRectangle(x - rx, y - ry, 2 * rx, 2 * ry)
+    
+    def GetValues(self):
+        '''Return the center and radii'''
+        return self.center, self.rad.GetValue(), self.rad2.GetValue()
 
 shape_list = [_('Circle'), _('Square'), _('Diamond'), _('Line'), _('Ellipse'), 
               _('Rectangle')]
 options = avsp.GetTextEntry(title=_('GraMaMa mask'), 
     message=[[_('Shape'), _('Horizontal radius'), _('Vertical radius'), _('Binarize')], 
+             _('Preview and adjust the mask before inserting it'), 
              _('Select the center of the mask after pressing OK')], 
-    default=[[shape_list + [shape], horizontal_radius, vertical_radius, binarize], 0], 
-    types=[['list_read_only', 'spin', 'spin', 'check'], 'sep'], 
+    default=[[shape_list + [shape], horizontal_radius, vertical_radius, binarize], 
+             preview, 0], 
+    types=[['list_read_only', 'spin', 'spin', 'check'], 'check', 'sep'], 
     width=0)
 if not options:
     return
@@ -85,6 +168,7 @@ for i, shape in enumerate(shape_list):
 rad = options[1]
 rad2 = options[2]
 binarize = options[3]
+preview = options[4]
 
 avs_text = avsp.GetText()
 re_assign = re.compile(r'\s*(\w+)\s*=')
@@ -97,9 +181,26 @@ if avs_text.endswith('\n'):
 else:
     avsp.InsertText('\nlast')
 xy = avsp.GetPixelInfo()
-avs = avsp.GetWindow().currentScript
+self = avsp.GetWindow()
+avs = self.currentScript
 avs.SetSelection(avs.PositionFromLine(avs.GetLineCount() - 1), -1)
 avs.Clear()
+if xy and preview:
+    # Draw the frame already shown on the video preview, instead of 
+    # evaluating the script with GraMaMa for every change
+    bitmap = wx.EmptyBitmap(avsp.GetVideoWidth(), avsp.GetVideoHeight())
+    mdc = wx.MemoryDC()
+    mdc.SelectObject(bitmap)
+    dc = mdc if self.version > '2.3.1' else mdc.GetHDC()
+    avs.AVI.DrawFrame(self.GetFrameNumber(), dc)
+    mdc.SelectObject(wx.NullBitmap)
+    dlg = PreviewDialog(self, bitmap, mode, xy[0], rad, rad2)
+    if dlg.ShowModal() == wx.ID_OK:
+        center, rad, rad2 = dlg.GetValues()
+        xy = [center]
+    else:
+        xy = None
+    dlg.Destroy()
 if xy:
     avsp.InsertText(u'Overlay({0}, mask=GraMaMa(mode={1}, a={2}, b={3}, '
                      'rad={4}, rad2={5}, binarize={6}).Invert(), mode="blend")'
@@ -1,15 +1,22 @@
 # -*- coding: utf-8 -*-
 
 """
-Pipe the script in the current tab to ImageMagick as RGB24 or RGB48
+Pipe the script in the current tab to ImageMagick as RGB, YUV or gray
 
 To send RGB48 the script must return a fake YV12 clip containing the RGB 
 data (see the Dither package docs for more info).
 
-To send RGB24 the clip must be already RGB24.  BGR24 in fact, as that is 
+RGB24 and RGB32 clips are sent as RGB and RGBA.  BGR in fact, as that is 
 the order AviSynth/AvxSynth uses.  This macro reorders the data as RGB on 
 its own.
 
+YUY2, Y8 and planar YUV (YV12 if the 'YV12 is RGB48' option is unchecked, 
+YV16, YV24, YV411) are sent as they are, so the conversion to RGB is done 
+by ImageMagick instead of adding a ConvertToRGB to the script.  Planar YUV 
+and Y8 can also be 16-bit stacked (MSB on the top half, LSB on the bottom).  
+ImageMagick assumes Rec.601 YCbCr.  For Rec.709 add '-set colorspace 
+Rec709YCbCr' to the processing arguments.
+
 
 Video range
 
@@ -44,10 +51,44 @@ to uncheck the 'Add the padded frame number as suffix' option.  To create
 GIFs better use this other macro: 
 https://github.com/vdcrim/AvsP-macros/blob/master/Create GIF with ImageMagick.py
 
+Every batch is sent to a new ImageMagick process.  Several of them can run 
+at the same time, so the next batches are piped while the previous ones 
+are still being processed.  Each running process needs the memory for all 
+the frames of its batch.
+
+The frames can also be rendered by AviSynth in a separate thread, a number 
+of them ahead of the one being piped.  Every frame ahead needs its own 
+buffer, so set it lower for big frames if memory is an issue.
+
+An interrupted export can be resumed by checking the 'skip the batches 
+already saved' option and running the macro again with the same settings. 
+A batch is skipped if all its output files exist (PNG files must also be 
+complete).  The files of the batches that are cancelled or fail are 
+deleted.
+
+Frames equal to the previous one can be skipped, e.g. on animation.  With 
+a tolerance of 0 only identical frames are skipped, otherwise the frames 
+that don't differ more than that value at any byte.  The first frame of 
+every batch is always sent.  The skipped frames are listed in a 
+'basename_duplicates.txt' file on the output directory, one 'skipped_frame 
+kept_frame' pair per line.  When using ImageMagick the frames are sent as 
+MIFF in this case, so only RGB and Y8 are supported.
+
+
+Built-in encoders
+
+If there are no ImageMagick processing arguments, the padded frame number 
+is added as suffix, the extension is .png, .ppm, .tif or .tiff and the 
+clip is RGB24, RGB48 or Y8 then the frames are saved directly by the 
+macro (uncompressed in the case of TIFF), without starting 'convert'.  
+The number of processes option sets the number of encoding threads in 
+that case.
+
 
 Requirements:
 
-- 'convert' executable from ImageMagick <http://www.imagemagick.org>
+- 'convert' executable from ImageMagick <http://www.imagemagick.org>, 
+  unless only the built-in encoders are used
 
 By default the executable is expected to be found in 'AvsPmod\tools' or 
 one of its subdirectories.  On *nix it can also be in PATH (there's already 
@@ -62,7 +103,7 @@ If you only need ImageMagick for this macro then do the following:
 3) place it on the 'AvsPmod\tools' directory
 
 
-Date: 2013-03-14
+Date: 2026-10-16
 Latest version:  https://github.com/vdcrim/avsp-macros
 
 Changelog:
@@ -72,6 +113,14 @@ Changelog:
 - add 'when using bookmarks save every range to a subdirectory' option
 - bookmarks can not longer be used as splitting points
 - improve error reporting
+- reuse the frame buffers instead of allocating a new one for every frame
+- add option to run several ImageMagick processes at the same time
+- add option to render the frames ahead in a separate thread
+- reorder RGB24 on the copied frame instead of using AviSynth filters
+- add option to skip the batches already saved, delete unfinished ones
+- save PNG, PPM and TIFF without ImageMagick if there's no processing to do
+- accept RGB32, YUY2, planar YUV, Y8 and 16-bit stacked YUV/Y8
+- add option to skip duplicate frames
 
 
 Copyright (C) 2012, 2013  Diego Fernández Gosende <dfgosende@gmail.com>
@@ -104,9 +153,23 @@ import subprocess
 import shlex
 import re
 import ctypes
+import struct
+import zlib
+import audioop
+import threading
+import Queue
 
 import avisynth
 
+P_UBYTE = ctypes.POINTER(ctypes.c_ubyte)
+
+try:
+    buffer_view = memoryview
+    view_bytes = memoryview.tobytes
+except NameError: # Python 2.6
+    buffer_view = buffer
+    view_bytes = str
+
 def check_executable_path(executable, check_PATH_Windows=True, check_PATH_nix=False, 
                           error_message=None):
     """Check if executable is in the 'tools' directory or its subdirectories or PATH"""
@@ -186,10 +249,18 @@ def float_range_list(start, stop, step):
 class Clip(object):
     '''Basic avs script loading class with raw output
     
-    Only accepts YV12 and RGB24, and reorders the later (BGR to RGB)
+    Accepts RGB24, RGB32, YUY2, planar YUV and Y8.  YV12 is taken as 
+    RGB48 on a fake YV12 clip unless fake_rgb48 is False, and planar YUV 
+    and Y8 as 16-bit stacked (MSB on top, LSB on the bottom) if stacked 
+    is True.  RGB is reordered (BGR to RGB, bottom-up to top-down), YUY2 
+    is sent as UYVY and 16-bit stacked as big-endian when copying the frame
+    
+    The frames are copied to a ring of preallocated buffers, so the data 
+    returned by raw_frame is only valid until 'buffers' more frames are 
+    requested
     
     '''
-    def __init__(self, text, filename=''):
+    def __init__(self, text, filename='', buffers=1, fake_rgb48=True, stacked=False):
         self.error = None
         self.incorrect_colorspace = False
         self.env = avisynth.avs_create_script_environment(3)
@@ -211,50 +282,241 @@ class Clip(object):
             return
         self.clip = clip.AsClip(self.env)
         self.vi = self.clip.GetVideoInfo()
-        if self.vi.IsYV12():
+        os.chdir(curdir)
+        self.depth = 8
+        self.real_width = self.vi.width
+        self.real_height = self.vi.height
+        self.planes = None
+        self.stacked = False
+        self.swap = None # (step, first byte, second byte)
+        self.bottom_up = False
+        bits_per_pixel = self.vi.BitsPerPixel()
+        if self.vi.IsYV12() and fake_rgb48:
             self.depth = 16
             self.real_width = self.vi.width / 2
             self.real_height = self.vi.height / 2
-        elif self.vi.IsRGB24():
-            self.depth = 8
-            self.real_width = self.vi.width
-            self.real_height = self.vi.height
-            # BGR -> RGB
-            clip = avisynth.AVS_Value(self.clip)
-            r = self.env.Invoke("ShowRed", clip, 0)
-            b = self.env.Invoke("ShowBlue", clip, 0)
-            merge_args = avisynth.AVS_Value([b, clip, r, avisynth.AVS_Value("RGB24")])
-            clip = self.env.Invoke("MergeRGB", merge_args, 0)
-            self.clip = self.env.Invoke("FlipVertical", clip, 0).AsClip(self.env)
+            self.planes = (avisynth.PLANAR_Y, avisynth.PLANAR_U, avisynth.PLANAR_V)
+            self.im_format = 'rgb'
+        elif self.vi.IsRGB24() or self.vi.IsRGB32():
+            self.bottom_up = True
+            self.swap = bits_per_pixel >> 3, 0, 2
+            self.im_format = 'rgb' if self.vi.IsRGB24() else 'rgba'
+        elif self.vi.IsYUY2():
+            self.swap = 2, 0, 1
+            self.im_format = 'uyvy'
+        elif self.vi.IsPlanar():
+            if bits_per_pixel == 8: # Y8
+                self.planes = (avisynth.PLANAR_Y,)
+                self.im_format = 'gray'
+            else:
+                self.planes = (avisynth.PLANAR_Y, avisynth.PLANAR_U, avisynth.PLANAR_V)
+                self.im_format = 'yuv'
+                self.sampling_factor = {12: '4:2:0' if self.vi.IsYV12() else '4:1:1', 
+                                        16: '4:2:2', 24: '4:4:4'}[bits_per_pixel]
+            if stacked:
+                self.stacked = True
+                self.depth = 16
+                self.real_height = self.vi.height / 2
         else:
             self.incorrect_colorspace = True
-        os.chdir(curdir)
+            return
+        self.channels = {'rgb': 3, 'rgba': 4, 'gray': 1}.get(self.im_format)
+        self.total_bytes = self.vi.width * self.vi.height * bits_per_pixel >> 3
+        self.buffers = []
+        for i in range(buffers):
+            buf = bytearray(self.total_bytes)
+            c_buf = (ctypes.c_ubyte * self.total_bytes).from_buffer(buf)
+            self.buffers.append((buf, ctypes.addressof(c_buf), c_buf))
+        if self.stacked: # the frame is copied here before interleaving
+            buf = bytearray(self.total_bytes)
+            c_buf = (ctypes.c_ubyte * self.total_bytes).from_buffer(buf)
+            self.stacked_buffer = buf, ctypes.addressof(c_buf), c_buf
+        self.buffer_index = 0
+    
+    def im_input(self):
+        '''Return the ImageMagick input format and options for stdin'''
+        if self.im_format == 'yuv':
+            return '-sampling-factor {0} -interlace plane yuv:-'.format(self.sampling_factor)
+        return self.im_format + ':-'
+    
+    def miff_header(self, scene):
+        '''Return a MIFF header for a frame, only for RGB(A) and gray'''
+        header = ['id=ImageMagick class=DirectClass columns={0} rows={1} depth={2} '
+                  'scene={3}'.format(self.real_width, self.real_height, self.depth, scene)]
+        if self.im_format == 'rgba':
+            header.append('matte=True')
+        elif self.im_format == 'gray':
+            header.append('colorspace=Gray')
+        if self.depth == 16:
+            header.append('endian=MSB')
+        return ' '.join(header) + '\n\f\n:\x1a'
     
     def raw_frame(self, frame):
         '''Get a buffer of raw video data'''
         frame = self.clip.GetFrame(frame)
-        total_bytes = self.vi.width * self.vi.height * self.vi.BitsPerPixel() >> 3
-        buf = ctypes.create_string_buffer(total_bytes)
-        write_addr = ctypes.addressof(buf)
-        P_UBYTE = ctypes.POINTER(ctypes.c_ubyte)
-        if self.vi.IsPlanar() and (avsp.GetWindow().version < '2.4.0' or not self.vi.IsY8()):
-            for plane in (avisynth.PLANAR_Y, avisynth.PLANAR_U, avisynth.PLANAR_V):
+        buf, write_addr = self.buffers[self.buffer_index][:2]
+        self.buffer_index = (self.buffer_index + 1) % len(self.buffers)
+        if self.planes:
+            if self.stacked:
+                stacked_buf, write_addr = self.stacked_buffer[:2]
+            for plane in self.planes:
                 write_ptr = ctypes.cast(write_addr, P_UBYTE)
                 self.env.BitBlt(write_ptr, frame.GetRowSize(plane), frame.GetReadPtr(plane), 
                     frame.GetPitch(plane), frame.GetRowSize(plane), frame.GetHeight(plane))
                 write_addr += frame.GetRowSize(plane) * frame.GetHeight(plane)
+            if self.stacked:
+                # Interleave the MSB (top half) and LSB (bottom half) of every plane
+                offset = 0
+                for plane in self.planes:
+                    size = frame.GetRowSize(plane) * frame.GetHeight(plane)
+                    half = offset + size / 2
+                    buf[offset:offset+size:2] = stacked_buf[offset:half]
+                    buf[offset+1:offset+size:2] = stacked_buf[half:offset+size]
+                    offset += size
         else:
-            # Note that AviSynth uses BGR
-            write_ptr = ctypes.cast(write_addr, P_UBYTE)
-            self.env.BitBlt(write_ptr, frame.GetRowSize(), frame.GetReadPtr(), 
-                        frame.GetPitch(), frame.GetRowSize(), frame.GetHeight())
-        return buf
+            row_size = frame.GetRowSize()
+            pitch = frame.GetPitch()
+            height = frame.GetHeight()
+            if self.bottom_up:
+                # AviSynth stores RGB bottom-up.  Copy the rows in reverse order
+                read_addr = ctypes.cast(frame.GetReadPtr(), ctypes.c_void_p).value
+                read_addr += pitch * (height - 1)
+                for row in range(height):
+                    ctypes.memmove(write_addr, read_addr, row_size)
+                    write_addr += row_size
+                    read_addr -= pitch
+            else:
+                write_ptr = ctypes.cast(write_addr, P_UBYTE)
+                self.env.BitBlt(write_ptr, row_size, frame.GetReadPtr(), pitch, 
+                                row_size, height)
+            if self.swap:
+                # BGR(A) -> RGB(A), YUYV -> UYVY
+                step, first, second = self.swap
+                temp = buf[first::step]
+                buf[first::step] = buf[second::step]
+                buf[second::step] = temp
+        return buffer_view(buf)
     
     def __del__(self):
         if hasattr(self, 'clip'):
             self.clip.Release()
         self.env.Release()
 
+class DuplicateFilter(object):
+    '''Tell if a frame is equal to the last one that wasn't a duplicate
+    
+    If tolerance is not 0 the frames are compared byte by byte, and 
+    they're considered equal if no difference is bigger than it.  Otherwise 
+    only the CRC-32 of the frames is compared
+    
+    '''
+    def __init__(self, tolerance=0):
+        self.tolerance = tolerance
+        self.reset()
+    
+    def reset(self):
+        '''Forget the last frame'''
+        self.last = None
+        self.last_frame = None
+    
+    def duplicate_of(self, frame, data):
+        '''Return the number of the frame this one duplicates, or None'''
+        data = view_bytes(data)
+        if self.tolerance:
+            # audioop works on signed samples, so convert the bytes first.  
+            # They're widened to 16-bit and halved (value * 128), so the 
+            # difference can't saturate
+            data = audioop.mul(audioop.lin2lin(audioop.bias(data, 1, -128), 1, 2), 
+                               2, 0.5)
+            duplicate = self.last is not None and audioop.max(audioop.add(
+                data, audioop.mul(self.last, 2, -1), 2), 2) <= self.tolerance * 128
+        else:
+            data = zlib.crc32(data)
+            duplicate = data == self.last
+        if duplicate:
+            return self.last_frame
+        self.last = data
+        self.last_frame = frame
+
+
+def png_chunk(tag, data):
+    '''Return a PNG chunk'''
+    crc = zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff
+    return ''.join((struct.pack('>I', len(data)), tag, data, struct.pack('>I', crc)))
+
+def encode_png(data, width, height, depth, channels):
+    '''Encode packed RGB or gray data (16-bit as big-endian) as PNG'''
+    row_size = width * channels * depth >> 3
+    rows = [data[i:i+row_size] for i in range(0, len(data), row_size)]
+    # Filter type 0 (none) for every row
+    idat = zlib.compress('\x00' + '\x00'.join(rows))
+    color_type = 2 if channels == 3 else 0
+    ihdr = struct.pack('>IIBBBBB', width, height, depth, color_type, 0, 0, 0)
+    return ''.join(('\x89PNG\r\n\x1a\n', png_chunk('IHDR', ihdr), 
+                    png_chunk('IDAT', idat), png_chunk('IEND', '')))
+
+def encode_ppm(data, width, height, depth, channels):
+    '''Encode packed RGB or gray data (16-bit as big-endian) as binary PPM/PGM'''
+    return 'P{0}\n{1} {2}\n{3}\n'.format(6 if channels == 3 else 5, width, height, 
+                                          (1 << depth) - 1) + data
+
+def encode_tiff(data, width, height, depth, channels):
+    '''Encode packed RGB or gray data (16-bit as big-endian) as uncompressed TIFF'''
+    # Big-endian, one strip.  The values that don't fit in the IFD entries 
+    # (BitsPerSample for RGB, XResolution, YResolution) go after it, then 
+    # the data
+    offset = 8 + 2 + 13 * 12 + 4
+    if channels == 3:
+        bits_per_sample = (258, 3, 3, offset)
+        extra = struct.pack('>3H', depth, depth, depth)
+    else:
+        bits_per_sample = (258, 3, 1, depth)
+        extra = ''
+    entries = ((256, 4, 1, width),                   # ImageWidth
+               (257, 4, 1, height),                  # ImageLength
+               bits_per_sample,                      # BitsPerSample
+               (259, 3, 1, 1),                       # Compression: none
+               (262, 3, 1, 2 if channels == 3 else 1), # PhotometricInterpretation
+               (273, 4, 1, offset + len(extra) + 16), # StripOffsets
+               (277, 3, 1, channels),                # SamplesPerPixel
+               (278, 4, 1, height),                  # RowsPerStrip
+               (279, 4, 1, len(data)),               # StripByteCounts
+               (282, 5, 1, offset + len(extra)),     # XResolution
+               (283, 5, 1, offset + len(extra) + 8), # YResolution
+               (284, 3, 1, 1),                       # PlanarConfiguration: chunky
+               (296, 3, 1, 1))                       # ResolutionUnit: none
+    header = ['MM\x00\x2a', struct.pack('>IH', 8, len(entries))]
+    for tag, type, count, value in entries:
+        if type == 3 and count == 1:
+            header.append(struct.pack('>HHIHH', tag, type, count, value, 0))
+        else:
+            header.append(struct.pack('>HHII', tag, type, count, value))
+    header.extend((struct.pack('>I', 0), extra, struct.pack('>4I', 72, 1, 72, 1)))
+    return ''.join(header) + data
+
+def write_frames(tasks, encoder, width, height, depth, channels, errors):
+    '''Encode and save the frames in the queue until None is found'''
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        path, data = task
+        if errors:
+            continue
+        # Write to a temporary file first so a partial file is never 
+        # mistaken for a finished one
+        temp_path = path + '.tmp'
+        try:
+            data = encoder(data, width, height, depth, channels)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            if os.path.isfile(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except Exception, err:
+            errors.append(str(err))
+            remove_files([temp_path])
+
 
 self = avsp.GetWindow()
 
@@ -273,13 +535,13 @@ last_ext = avsp.Options.get('last_ext', '.png')
 add_frame_number = avsp.Options.get('add_frame_number', True)
 use_subdirs = avsp.Options.get('use_subdirs', False)
 show_progress = avsp.Options.get('show_progress', True)
-
-# Check convert path
-if not os.path.isfile(convert_path):
-    if not check_executable_path('convert', False, True,
-                                 _("'convert' from ImageMagick not found")):
-        return
-    convert_path = avsp.Options['convert_path']
+skip_existing = avsp.Options.get('skip_existing', False)
+workers = avsp.Options.get('workers', 1)
+queue_size = avsp.Options.get('queue_size', 2)
+skip_duplicates = avsp.Options.get('skip_duplicates', False)
+duplicate_tolerance = avsp.Options.get('duplicate_tolerance', 0)
+fake_rgb48 = avsp.Options.get('fake_rgb48', True)
+stacked = avsp.Options.get('stacked', False)
 
 # Get the default output path
 output_path = avs_path = avsp.GetScriptFilename()
@@ -311,26 +573,36 @@ while True:
                  [_('Frame step'), _('Time step'), _('Number of intervals')], 
                  _('Include only the range between bookmarks, if any'), 
                  _('Include only bookmarks, if any'),
+                 _('Number of ImageMagick processes or encoding threads running at the same time'), 
+                 _('Number of frames rendered ahead of the pipe (0: disabled)'), 
+                 [_('YV12 is RGB48 (fake YV12)'), _('YUV and Y8 are 16-bit stacked')], 
+                 [_('Skip frames equal to the previous one'), 
+                  _('Tolerance (0: identical)')], 
                  '', _('Output options'), 
                  _('ImageMagick processing arguments (excluding input)'), 
                  _('Choose an output directory, basename and extension'), 
                  [_('Use always this directory'), _('Use always this basename')], 
                  _('Add the padded frame number as suffix'), 
                  _('When using bookmarks, save every range to a subdirectory'), 
+                 _('Skip the batches already saved (resume a previous run)'), 
                  _('Show progress')], 
         default=['', election_list, 
                  [(frame_step, 1, None, 0, max(1, 10 ** (len(str(frame_step)) - 2))), 
                   time_step, (intervals, 1)], only_bookmarks_ranges, only_bookmarks, 
-                  0, '', im_args, output_path, [use_dir, use_base], add_frame_number, 
-                  use_subdirs, show_progress], 
-        types=['sep', 'list_read_only', ['spin', '', 'spin'], 'check', 'check', 'sep', 
-               'sep', '', 'file_save', ['check', 'check'], 'check', 'check', 'check'], 
+                  (workers, 1, 64), (queue_size, 0, 256), [fake_rgb48, stacked], 
+                  [skip_duplicates, (duplicate_tolerance, 0, 100)], 0, '', im_args, 
+                  output_path, [use_dir, use_base], add_frame_number, use_subdirs, 
+                  skip_existing, show_progress], 
+        types=['sep', 'list_read_only', ['spin', '', 'spin'], 'check', 'check', 'spin', 
+               'spin', ['check', 'check'], ['check', 'spin'], 'sep', 'sep', '', 'file_save', 
+               ['check', 'check'], 'check', 'check', 'check', 'check'], 
         width=300)
     if not options:
         return
     (election, frame_step, time_step, intervals, only_bookmarks_ranges, 
-     only_bookmarks, im_args, output_path, use_dir, use_base, add_frame_number, 
-     use_subdirs, show_progress) = options
+     only_bookmarks, workers, queue_size, fake_rgb48, stacked, skip_duplicates, 
+     duplicate_tolerance, im_args, output_path, use_dir, use_base, 
+     add_frame_number, use_subdirs, skip_existing, show_progress) = options
     if election == _('specifying a time step'):
         time_step_ms = parse_time(time_step)
         if not time_step_ms:
@@ -351,6 +623,12 @@ avsp.Options['time_step'] = time_step
 avsp.Options['intervals'] = intervals
 avsp.Options['only_bookmarks_ranges'] = only_bookmarks_ranges
 avsp.Options['only_bookmarks'] = only_bookmarks
+avsp.Options['workers'] = workers
+avsp.Options['queue_size'] = queue_size
+avsp.Options['skip_duplicates'] = skip_duplicates
+avsp.Options['duplicate_tolerance'] = duplicate_tolerance
+avsp.Options['fake_rgb48'] = fake_rgb48
+avsp.Options['stacked'] = stacked
 avsp.Options['im_args'] = im_args
 avsp.Options['use_dir'] = use_dir
 avsp.Options['use_base'] = use_base
@@ -361,6 +639,7 @@ if use_base:
 avsp.Options['last_ext'] = ext
 avsp.Options['add_frame_number'] = add_frame_number
 avsp.Options['use_subdirs'] = use_subdirs
+avsp.Options['skip_existing'] = skip_existing
 avsp.Options['show_progress'] = show_progress
 
 # Eval script
@@ -368,12 +647,29 @@ if self.version > '2.3.1':
     text = avsp.GetText(clean=True)
 else:
     text = self.getCleanText(avsp.GetText())
-clip = Clip(text, avs_path)   
+clip = Clip(text, avs_path, queue_size + 2 if queue_size else 1, fake_rgb48, stacked)
 if clip.error is not None:
     avsp.MsgBox('\n\n'.join((_('Error loading the script'), clip.error)), _('Error'))
     return
 if clip.incorrect_colorspace:
-    avsp.MsgBox(_('Colorspace must be RGB24 or (fake) YV12 (RGB48)'), _('Error'))
+    avsp.MsgBox(_('Colorspace must be RGB24, RGB32, YUY2, planar YUV or Y8'), _('Error'))
+    return
+
+# Save the frames directly if there's nothing for ImageMagick to do
+encoders = {'.png': encode_png, '.ppm': encode_ppm, '.tif': encode_tiff, 
+            '.tiff': encode_tiff}
+native = (not im_args.strip() and add_frame_number and ext.lower() in encoders and 
+          clip.im_format in ('rgb', 'gray'))
+
+# Check convert path
+if not native and not os.path.isfile(convert_path):
+    if not check_executable_path('convert', False, True,
+                                 _("'convert' from ImageMagick not found")):
+        return
+    convert_path = avsp.Options['convert_path']
+if skip_duplicates and not native and clip.im_format not in ('rgb', 'rgba', 'gray'):
+    avsp.MsgBox(_('Skipping duplicate frames is only supported for RGB and Y8 when '
+                  'using ImageMagick'), _('Error'))
     return
 
 # Get the list of frame ranges
@@ -421,88 +717,305 @@ frame_list = [float_range_list(frame_range[0], frame_range[1], step) for frame_r
 #   http://bugs.python.org/issue3905
 #   http://bugs.python.org/issue1124861
 encoding = sys.getfilesystemencoding()
+
+def render_frames(clip, batches, frames, abort):
+    '''Render the frames of every batch into a queue, in order'''
+    def put(item):
+        while not abort.isSet():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+    try:
+        for start, end, scene, path in batches:
+            for frame in range(start, end):
+                if not put(clip.raw_frame(frame)):
+                    return
+    except Exception, err:
+        put(err)
+
+def numbered_path(path, number):
+    '''Replace the frame number pattern in an output path'''
+    head, tail = path.rsplit(suffix, 1)
+    return u'{0}-{1:0{2}}{3}'.format(head, number, digits, tail)
+
+def output_files(start, end, scene, path):
+    '''Return the list of files a batch is saved to, except duplicates'''
+    if not add_frame_number:
+        return [path]
+    return [numbered_path(path, scene + i) for i in range(end - start) 
+            if start + i not in duplicates]
+
+def read_duplicates(path):
+    '''Read a 'skipped_frame kept_frame' per line file into a dict'''
+    duplicates = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    skipped, kept = [int(value) for value in line.split()]
+                except ValueError:
+                    continue
+                duplicates[skipped] = kept
+    except IOError:
+        pass
+    return duplicates
+
+def is_complete(path):
+    '''Check if an output file exists and was completely written'''
+    try:
+        size = os.path.getsize(path)
+        if path.lower().endswith('.png'):
+            # The last chunk must be IEND
+            with open(path, 'rb') as f:
+                f.seek(-8, os.SEEK_END)
+                return f.read(4) == 'IEND'
+        return size > 0
+    except (IOError, os.error):
+        return False
+
+def remove_files(files):
+    '''Delete the output of an unfinished batch'''
+    for path in files:
+        try:
+            os.remove(path)
+        except os.error:
+            pass
+
+def start_convert(cmd):
+    '''Start a 'convert' process reading from stdin'''
+    cmd = shlex.split(cmd.encode(encoding))
+    if os.name == 'nt':
+        info = subprocess.STARTUPINFO()
+        try:
+            info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            info.wShowWindow = subprocess.SW_HIDE
+        except AttributeError:
+            import _subprocess
+            info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
+            info.wShowWindow = _subprocess.SW_HIDE
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                stderr=subprocess.STDOUT, startupinfo=info)
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                            stderr=subprocess.STDOUT)
+
+# Get the list of batches, as (first frame, last frame + 1, scene, output path)
 total_batches = 0
-if show_progress:
-    for frame_range in frame_list:
-        total_batches += len(frame_range) - 1
-    progress = avsp.ProgressBox(2 * total_batches)
+for frame_range in frame_list:
+    total_batches += len(frame_range) - 1
 if add_frame_number:
     digits = len(str(frame_list[-1][-1] - 1))
     suffix = '-%0{0}d'.format(digits)
 else:
-    if not total_batches:
-        for frame_range in frame_list:
-            total_batches += len(frame_range) - 1
     digits = len(str(total_batches))
 if use_subdirs:
     digits_frame_list = len(str(len(frame_list)))
-start_batch_number = 0
+batches = []
 frame_count = 0
-for range_index, frame_list in enumerate(frame_list):
+for range_index, frame_range in enumerate(frame_list):
     if use_subdirs:
-        title = self.bookmarkDict.get(frame_list[0])
+        title = self.bookmarkDict.get(frame_range[0])
         if not title:
             title =  _('scene_{0:0{1}}').format(range_index+1, digits_frame_list)
         dirname2 = os.path.join(dirname, title)
         if not os.path.isdir(dirname2): os.mkdir(dirname2)
         output_path = os.path.join(dirname2, basename)
-    for i, frame in enumerate(frame_list[:-1]):
-        i2 = i + start_batch_number
-        if show_progress and not avsp.SafeCall(progress.Update, 2*i2, 
-                    _('Piping batch {0}/{1}').format(i2+1, total_batches))[0]:
-            break
+    for i, frame in enumerate(frame_range[:-1]):
         if add_frame_number:
             scene = frame
         else:
-            suffix = '-{0:0{1}}'.format(i2+1, digits)
+            suffix = '-{0:0{1}}'.format(len(batches) + 1, digits)
             if use_subdirs:
-                scene = frame - frame_list[0]
+                scene = frame - frame_range[0]
             else:
                 scene = frame_count
-        
-        # Start the pipe
-        cmd = ur'"{0}" -depth {1} -size {2}x{3} rgb:- {4} -scene {5} "{6}{7}{8}"'.format(
-              convert_path, clip.depth, clip.real_width, clip.real_height, im_args, 
-              scene, output_path, suffix, ext).encode(encoding)
-        cmd = shlex.split(cmd)
-        if os.name == 'nt':
-            info = subprocess.STARTUPINFO()
-            try:
-                info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                info.wShowWindow = subprocess.SW_HIDE
-            except AttributeError:
-                import _subprocess
-                info.dwFlags |= _subprocess.STARTF_USESHOWWINDOW
-                info.wShowWindow = _subprocess.SW_HIDE
-            cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                                   stderr=subprocess.STDOUT, startupinfo=info)
+        batches.append((frame, frame_range[i+1], scene, output_path + suffix + ext))
+        frame_count += frame_range[i+1] - frame
+
+# Frames skipped for being duplicates, {skipped: kept}
+duplicates_path = os.path.join(dirname, basename + '_duplicates.txt')
+if skip_duplicates and skip_existing:
+    duplicates = read_duplicates(duplicates_path)
+else:
+    duplicates = {}
+
+# Leave out the batches saved on a previous run
+if skip_existing:
+    for batch in batches[:]:
+        for path in output_files(*batch):
+            if not is_complete(path):
+                break
         else:
-            cmd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                                   stderr=subprocess.STDOUT)
+            batches.remove(batch)
+    total_batches = len(batches)
+    if not total_batches:
+        avsp.MsgBox(_('All the batches were already saved'), _('Info'))
+        return
+
+# Save every batch with the built-in encoders, using 'workers' threads, or 
+# pipe it to a 'convert' process, keeping up to 'workers' of them running at 
+# the same time.  Batches are waited for in order.  If queue_size is not 0 
+# the frames are rendered in another thread, up to that number of frames 
+# ahead of the one being saved
+if show_progress:
+    progress = avsp.ProgressBox(2 * total_batches)
+if queue_size:
+    frames = Queue.Queue(queue_size)
+    abort = threading.Event()
+    renderer = threading.Thread(target=render_frames, 
+                                args=(clip, batches, frames, abort))
+    renderer.daemon = True
+    renderer.start()
+
+def next_frame(frame):
+    '''Get the next frame from the renderer thread or render it now'''
+    if not queue_size:
+        return clip.raw_frame(frame)
+    data = frames.get()
+    if isinstance(data, Exception):
+        raise data
+    return data
+
+duplicate_filter = DuplicateFilter(duplicate_tolerance)
+def skip_frame(frame, data):
+    '''Record the frame and return True if it's a duplicate to skip'''
+    if not skip_duplicates:
+        return False
+    original = duplicate_filter.duplicate_of(frame, data)
+    if original is None:
+        duplicates.pop(frame, None)
+        return False
+    duplicates[frame] = original
+    return True
+
+running = []
+finished = 0
+error = None
+if native:
+    tasks = Queue.Queue(2 * workers)
+    errors = []
+    writers = []
+    for i in range(workers):
+        writer = threading.Thread(target=write_frames, args=(tasks, 
+            encoders[ext.lower()], clip.real_width, clip.real_height, clip.depth, 
+            clip.channels, errors))
+        writer.daemon = True
+        writer.start()
+        writers.append(writer)
+    done = False
+    for i, (start, end, scene, path) in enumerate(batches):
+        batch = None
+        if show_progress and not avsp.SafeCall(progress.Update, 2 * i, 
+                _('Saving batch {0}/{1}').format(i+1, total_batches))[0]:
+            break
+        batch = start, end, scene, path
+        duplicate_filter.reset()
+        try:
+            for frame in range(start, end):
+                if errors:
+                    break
+                data = next_frame(frame)
+                if skip_frame(frame, data):
+                    continue
+                tasks.put((numbered_path(path, scene + frame - start), view_bytes(data)))
+        except Exception, err:
+            errors.append(str(err))
+        if errors:
+            break
+    else:
+        batch = None
+        done = True
+    for writer in writers:
+        tasks.put(None)
+    for writer in writers:
+        writer.join()
+    # The batch that was being saved when cancelling is left incomplete
+    if batch:
+        remove_files(output_files(*batch))
+    if errors:
+        error = errors[0]
+    elif done and show_progress:
+        avsp.SafeCall(progress.Update, 2 * total_batches, _('Finished'))
+else:
+    for i, (start, end, scene, path) in enumerate(batches):
+        if len(running) >= workers:
+            if show_progress and not avsp.SafeCall(progress.Update, i + finished, 
+                    _('Processing batch {0}/{1}').format(finished+1, total_batches))[0]:
+                break
+            cmd, files = running.pop(0)
+            if cmd.wait():
+                error = cmd.stdout.read()
+                remove_files(files)
+                break
+            finished += 1
+        if show_progress and not avsp.SafeCall(progress.Update, i + finished, 
+                    _('Piping batch {0}/{1}').format(i+1, total_batches))[0]:
+            break
         
-        # Pipe the data and wait for the process to finish
+        # Start the pipe and send the data.  When skipping duplicates every 
+        # frame is sent as MIFF, so its scene number is kept
+        files = output_files(start, end, scene, path)
+        if skip_duplicates:
+            cmd = start_convert(ur'"{0}" miff:- {1} "{2}"'.format(convert_path, 
+                                                                  im_args, path))
+        else:
+            cmd = start_convert(ur'"{0}" -depth {1} -size {2}x{3} {4} {5} -scene {6} "{7}"'.format(
+                  convert_path, clip.depth, clip.real_width, clip.real_height, 
+                  clip.im_input(), im_args, scene, path))
+        duplicate_filter.reset()
         try:
-            for every_frame in range(frame, frame_list[i+1]):
-                cmd.stdin.write(clip.raw_frame(every_frame))
-            frame_count += frame_list[i+1] - frame
+            for frame in range(start, end):
+                data = next_frame(frame)
+                if skip_frame(frame, data):
+                    continue
+                if skip_duplicates:
+                    cmd.stdin.write(clip.miff_header(scene + frame - start))
+                cmd.stdin.write(data)
             cmd.stdin.close()
-            if show_progress and not avsp.SafeCall(progress.Update, 2*i2+1, 
-                    _('Processing batch {0}/{1}').format(i2+1, total_batches))[0]:
-                cmd.terminate()
-                break
-            cmd.wait()
-        except:
-            if show_progress: avsp.SafeCall(progress.Destroy)
+        except Exception, err:
             try:
                 if cmd.poll() is None:
                     cmd.terminate()
             except: pass
-            avsp.MsgBox(cmd.stdout.read(), _('Error'))
-            return
+            error = cmd.stdout.read() or str(err)
+            remove_files(files)
+            break
+        running.append((cmd, files))
     else:
-        start_batch_number += i + 1
-        continue
-    break
-else:
-    if show_progress: avsp.SafeCall(progress.Update, 2*i2+2, _('Finished'))
+        while running:
+            if show_progress and not avsp.SafeCall(progress.Update, total_batches + finished, 
+                    _('Processing batch {0}/{1}').format(finished+1, total_batches))[0]:
+                break
+            cmd, files = running.pop(0)
+            if cmd.wait():
+                error = cmd.stdout.read()
+                remove_files(files)
+                break
+            finished += 1
+        else:
+            if show_progress: avsp.SafeCall(progress.Update, 2 * total_batches, _('Finished'))
+if queue_size:
+    abort.set()
+    renderer.join()
+for cmd, files in running:
+    # Keep the output of the batches that already finished fine
+    try:
+        if cmd.poll() is None:
+            cmd.terminate()
+            cmd.wait()
+        elif not cmd.returncode:
+            continue
+    except: pass
+    remove_files(files)
 if show_progress: avsp.SafeCall(progress.Destroy)
+if skip_duplicates:
+    try:
+        with open(duplicates_path, 'w') as f:
+            for frame in sorted(duplicates):
+                f.write('{0} {1}\n'.format(frame, duplicates[frame]))
+    except IOError, err:
+        if error is None:
+            error = str(err)
+if error is not None:
+    avsp.MsgBox(error, _('Error'))